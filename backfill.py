@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta, timezone
+from pymongo import ReturnDocument
+
+SUBMITTED = "submitted"
+DONE = "done"
+FAILED = "failed"
+
+MAX_VIDEOS = 200  # per /backfill
+BACKFILL_TTL = 7 * 24 * 60 * 60  # finished backfills are kept a week
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+class BackfillQueue:
+    # Back catalogue summaries waiting on an OpenAI batch, one document per
+    # batch with the videos it covers. Batches take minutes to hours, so they
+    # live in Mongo and any worker can check on them; a check is claimed
+    # atomically so only one worker stores and posts the results. Posted
+    # videos are recorded as they go, so a check cut short never posts twice.
+    def __init__(self, collection, poll_interval=60, lease_seconds=600):
+        self.collection = collection
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+
+    def setup(self):
+        self.collection.create_index([('state', 1), ('check_at', 1)])
+        self.collection.create_index('finished_at', expireAfterSeconds=BACKFILL_TTL)
+
+    def add(self, batch_id, guild_id, update_channel, videos):
+        now = utcnow()
+        self.collection.insert_one({
+            '_id': batch_id,
+            'guild_id': guild_id,
+            'update_channel': update_channel,
+            'videos': [list(video) for video in videos],
+            'posted': [],
+            'state': SUBMITTED,
+            'check_at': now + timedelta(seconds=self.poll_interval),
+            'created_at': now,
+        })
+
+    def claim(self, owner):
+        # The next batch due a check, held for a lease while it's handled
+        now = utcnow()
+        return self.collection.find_one_and_update(
+            {'state': SUBMITTED, 'check_at': {'$lte': now}},
+            {'$set': {'owner': owner, 'check_at': now + timedelta(seconds=self.lease_seconds)}},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def wait(self, batch_id):
+        # Still running: check again after the poll interval
+        self.collection.update_one(
+            {'_id': batch_id},
+            {'$set': {'check_at': utcnow() + timedelta(seconds=self.poll_interval)}},
+        )
+
+    def posted(self, batch_id, video_id):
+        self.collection.update_one({'_id': batch_id}, {'$addToSet': {'posted': video_id}})
+
+    def finish(self, batch_id, state, summaries=0, error=None):
+        self.collection.update_one(
+            {'_id': batch_id},
+            {'$set': {'state': state, 'summaries': summaries, 'error': error, 'finished_at': utcnow()}},
+        )
+
+    def counts(self):
+        counts = {SUBMITTED: 0, DONE: 0, FAILED: 0}
+        for row in self.collection.aggregate([{'$group': {'_id': '$state', 'count': {'$sum': 1}}}]):
+            counts[row['_id']] = row['count']
+        return counts
@@ -0,0 +1,1037 @@
+import argparse
+import asyncio
+import contextlib
+import email.parser
+import email.policy
+import json
+import os
+import random
+import resource
+import secrets
+import socket
+import statistics
+import subprocess
+import tempfile
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlencode, urlparse
+from xml.sax.saxutils import escape
+
+import discord
+from pymongo import MongoClient
+
+import gpt
+from backfill import SUBMITTED
+from bot import Quicktube
+from mongo_worker import MongoDBWorker
+from transcripts import TranscriptStore
+from websub import TOPIC_URL, PushSubscriber, sign
+from youtube_client import YouTubeClient
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+# Offline load test for Quicktube. Everything the bot talks to is replaced by
+# a local stand-in: a YouTube Data API + Atom feed server, an OpenAI-compatible
+# server, a transcript stub, an in-memory (or local) Mongo and a fake Discord
+# client. Exits non-zero when a --max-* threshold is exceeded, for CI.
+
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections is expected, anything else isn't
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubServer:
+    # Threaded local HTTP server that counts calls per route and sleeps
+    # `latency` seconds before answering each one
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real APIs
+
+            def do_GET(self):
+                stub.dispatch(self, "GET")
+
+            def do_POST(self):
+                stub.dispatch(self, "POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = QuietServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def dispatch(self, handler, method):
+        url = urlparse(handler.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        length = int(handler.headers.get("Content-Length") or 0)
+        data = handler.rfile.read(length) if length else b""
+        content_type = handler.headers.get("Content-Type", "")
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            body = {name: values[0] for name, values in parse_qs(data.decode("utf-8")).items()}
+        elif content_type.startswith("multipart/form-data"):
+            message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + data
+            )
+            body = {
+                part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+                for part in message.iter_parts()
+            }
+        else:
+            body = json.loads(data) if data else None
+        with self.lock:
+            self.calls[url.path] = self.calls.get(url.path, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        self.handle(handler, url.path, query, body)
+
+    def handle(self, handler, path, query, body):
+        self.reply(handler, 404, "text/plain", b"not found")
+
+    def reply(self, handler, status, content_type, data, headers=None):
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def reply_json(self, handler, data, status=200):
+        self.reply(handler, status, "application/json", json.dumps(data).encode("utf-8"))
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.calls)
+
+
+class YouTubeStub(StubServer):
+    # Serves the Atom feed and the Data API calls the bot makes, from an
+    # in-memory list of uploads per channel
+    def __init__(self, channel_count, latency=0.0, history=10, seed=0):
+        super().__init__(latency)
+        self.random = random.Random(seed)
+        self.channels = {}
+        self.handles = {}  # handle / username -> channel ID
+        now = time.time()
+        for index in range(channel_count):
+            channel_id = f"UCbench{index:017d}"
+            self.handles[f"bench{index}"] = channel_id
+            uploads = []
+            for n in range(history):
+                published = now - (history - n) * 24 * 60 * 60
+                uploads.append((f"v{index:05d}-{n:04d}", published))
+            self.channels[channel_id] = uploads
+        self.videos = {
+            video_id: (channel_id, published)
+            for channel_id, uploads in self.channels.items()
+            for video_id, published in uploads
+        }
+
+    def upload(self, rate):
+        # Each channel uploads a new video with probability `rate`
+        new = []
+        for channel_id in self.channels:
+            if self.random.random() < rate:
+                self.upload_to(channel_id)
+                new.append(channel_id)
+        return new
+
+    def upload_to(self, channel_id):
+        uploads = self.channels[channel_id]
+        video_id = f"v{int(channel_id[7:]):05d}-{len(uploads):04d}"
+        uploads.append((video_id, time.time()))
+        self.videos[video_id] = (channel_id, uploads[-1][1])
+        return video_id
+
+    def latest(self, channel_id):
+        return self.channels[channel_id][-1][0]
+
+    def snippet(self, video_id):
+        channel_id, published = self.videos[video_id]
+        return {
+            "title": f"Video {video_id}",
+            "channelTitle": f"Channel {channel_id}",
+            "channelId": channel_id,
+            "publishedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(published)),
+            "thumbnails": {"high": {"url": f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg"}},
+        }
+
+    def handle(self, handler, path, query, body):
+        if path == "/feeds/videos.xml":
+            channel_id = query.get("channel_id")
+            if self.not_modified(handler, channel_id):
+                return None
+            return self.feed(handler, channel_id)
+        if path == "/youtube/v3/channels":
+            name = query.get("forHandle", "").lstrip("@") or query.get("forUsername")
+            if name:
+                found = self.handles.get(name.lower())
+                return self.reply_json(handler, {"items": [{"id": found}] if found else []})
+            items = [
+                {
+                    "id": channel_id,
+                    "snippet": {
+                        "title": f"Channel {channel_id}",
+                        "thumbnails": {"high": {"url": f"https://yt3.ggpht.com/{channel_id}"}},
+                    },
+                    "contentDetails": {"relatedPlaylists": {"uploads": "UU" + channel_id[2:]}},
+                }
+                for channel_id in query.get("id", "").split(",") if channel_id in self.channels
+            ]
+            return self.reply_json(handler, {"items": items})
+        if path == "/youtube/v3/playlistItems":
+            channel_id = "UC" + query.get("playlistId", "")[2:]
+            if self.not_modified(handler, channel_id):
+                return None
+            if int(query.get("maxResults", 1)) > 1:
+                return self.reply_json(handler, self.uploads_page(channel_id, query))
+            return self.reply_json(handler, {
+                "etag": self.etag(channel_id),
+                "items": self.latest_items(channel_id, playlist=True),
+            })
+        if path == "/youtube/v3/search" and query.get("type") == "channel":
+            found = self.handles.get(query.get("q", "").lower())
+            return self.reply_json(handler, {"items": [{"snippet": {"channelId": found}}] if found else []})
+        if path == "/youtube/v3/search":
+            return self.reply_json(handler, {"items": self.latest_items(query.get("channelId"))})
+        if path == "/youtube/v3/videos":
+            items = [
+                {"id": video_id, "snippet": self.snippet(video_id)}
+                for video_id in query.get("id", "").split(",") if video_id in self.videos
+            ]
+            return self.reply_json(handler, {"items": items})
+        super().handle(handler, path, query, body)
+
+    def etag(self, channel_id):
+        if channel_id not in self.channels:
+            return None
+        return f'"{self.latest(channel_id)}"'
+
+    def not_modified(self, handler, channel_id):
+        # Answers a conditional request with a bodiless 304 when nothing was uploaded
+        etag = self.etag(channel_id)
+        if etag is None or handler.headers.get("If-None-Match") != etag:
+            return False
+        with self.lock:
+            self.calls["304"] = self.calls.get("304", 0) + 1
+        handler.send_response(304)
+        handler.send_header("ETag", etag)
+        handler.end_headers()
+        return True
+
+    def latest_items(self, channel_id, playlist=False):
+        if channel_id not in self.channels:
+            return []
+        video_id = self.latest(channel_id)
+        snippet = self.snippet(video_id)
+        if playlist:
+            details = {"videoId": video_id, "videoPublishedAt": snippet["publishedAt"]}
+            return [{"snippet": snippet, "contentDetails": details}]
+        return [{"id": {"videoId": video_id}, "snippet": snippet}]
+
+    def uploads_page(self, channel_id, query):
+        # Paged uploads playlist, newest first, for backfills
+        start = int(query.get("pageToken") or 0)
+        end = start + int(query["maxResults"])
+        video_ids = [video_id for video_id, _ in reversed(self.channels.get(channel_id, []))]
+        items = []
+        for video_id in video_ids[start:end]:
+            snippet = self.snippet(video_id)
+            details = {"videoId": video_id, "videoPublishedAt": snippet["publishedAt"]}
+            items.append({"snippet": snippet, "contentDetails": details})
+        page = {"items": items}
+        if end < len(video_ids):
+            page["nextPageToken"] = str(end)
+        return page
+
+    def feed(self, handler, channel_id):
+        if channel_id not in self.channels:
+            return self.reply(handler, 404, "text/plain", b"not found")
+        entries = []
+        for video_id, _ in reversed(self.channels[channel_id][-15:]):
+            snippet = self.snippet(video_id)
+            entries.append(
+                f"<entry><yt:videoId>{video_id}</yt:videoId>"
+                f"<title>{escape(snippet['title'])}</title>"
+                f"<author><name>{escape(snippet['channelTitle'])}</name></author>"
+                f"<published>{snippet['publishedAt']}</published>"
+                f"<media:group><media:thumbnail url=\"{snippet['thumbnails']['high']['url']}\"/>"
+                f"</media:group></entry>"
+            )
+        feed = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<feed xmlns="http://www.w3.org/2005/Atom" '
+            'xmlns:yt="http://www.youtube.com/xml/schemas/2015" '
+            'xmlns:media="http://search.yahoo.com/mrss/">'
+            + "".join(entries) + "</feed>"
+        )
+        self.reply(
+            handler, 200, "application/atom+xml", feed.encode("utf-8"),
+            {"ETag": self.etag(channel_id)},
+        )
+
+
+class OpenAIStub(StubServer):
+    # OpenAI-compatible /v1/chat/completions, streaming or not, plus the
+    # /v1/files and /v1/batches calls of the Batch API. A batch completes
+    # batch_latency seconds after it was created.
+    def __init__(self, latency=0.0, token_delay=0.0, reply_words=60, batch_latency=2.0):
+        super().__init__(latency)
+        self.token_delay = token_delay
+        self.reply_words = reply_words
+        self.batch_latency = batch_latency
+        self.files = {}
+        self.batches = {}
+        self.batched_requests = 0
+
+    def reply_text(self):
+        return "## Summary\n" + " ".join(f"word{n}" for n in range(self.reply_words))
+
+    def handle(self, handler, path, query, body):
+        if path == "/v1/files" and body:
+            file_id = self.add_file(body["file"], body["purpose"].decode("utf-8"))
+            return self.reply_json(handler, {"id": file_id, "object": "file"})
+        if path.startswith("/v1/files/") and path.endswith("/content"):
+            data = self.files.get(path.split("/")[3])
+            if data is None:
+                return super().handle(handler, path, query, body)
+            return self.reply(handler, 200, "application/jsonl", data)
+        if path == "/v1/batches" and body:
+            return self.reply_json(handler, self.create_batch(body["input_file_id"]))
+        if path.startswith("/v1/batches/"):
+            batch = self.batch(path.split("/")[3])
+            if batch is None:
+                return super().handle(handler, path, query, body)
+            return self.reply_json(handler, batch)
+        if path != "/v1/chat/completions":
+            return super().handle(handler, path, query, body)
+        words = [f"word{n}" for n in range(self.reply_words)]
+        reply = self.reply_text()
+        if not body.get("stream"):
+            if self.token_delay:
+                time.sleep(self.token_delay * len(words))
+            return self.reply_json(handler, {"choices": [{"message": {"content": reply}}]})
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+        for word in ["## Summary\n"] + [word + " " for word in words]:
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            event = {"choices": [{"delta": {"content": word}}]}
+            self.write_chunk(handler, f"data: {json.dumps(event)}\n\n")
+        self.write_chunk(handler, "data: [DONE]\n\n")
+        handler.wfile.write(b"0\r\n\r\n")
+
+    def add_file(self, data, purpose):
+        with self.lock:
+            file_id = f"file-{len(self.files) + 1}"
+            self.files[file_id] = data
+        return file_id
+
+    def create_batch(self, input_file_id):
+        with self.lock:
+            batch_id = f"batch_{len(self.batches) + 1}"
+            self.batches[batch_id] = {
+                "id": batch_id,
+                "object": "batch",
+                "input_file_id": input_file_id,
+                "status": "in_progress",
+                "created": time.monotonic(),
+            }
+            return dict(self.batches[batch_id])
+
+    def batch(self, batch_id):
+        # Finishes the batch on the first check after batch_latency
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch is None:
+                return None
+            if batch["status"] != "in_progress" or time.monotonic() - batch["created"] < self.batch_latency:
+                return dict(batch)
+            lines = []
+            for line in self.files[batch["input_file_id"]].decode("utf-8").splitlines():
+                request = json.loads(line)
+                self.batched_requests += 1
+                lines.append(json.dumps({
+                    "id": f"req-{self.batched_requests}",
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "body": {"choices": [{"message": {"content": self.reply_text()}}]},
+                    },
+                    "error": None,
+                }))
+            output_id = f"file-{len(self.files) + 1}"
+            self.files[output_id] = ("\n".join(lines) + "\n").encode("utf-8")
+            batch.update(status="completed", output_file_id=output_id)
+            return dict(batch)
+
+    def write_chunk(self, handler, text):
+        data = text.encode("utf-8")
+        handler.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        handler.wfile.flush()
+
+
+class HubStub(StubServer):
+    # WebSub hub stand-in: checks each (un)subscribe against the callback with
+    # a challenge, then pushes signed Atom notifications for new uploads
+    def __init__(self, youtube, latency=0.0):
+        super().__init__(latency)
+        self.youtube = youtube
+        self.subscriptions = {}  # topic -> {callback: secret}
+        self.pushes = 0
+        self.pool = ThreadPoolExecutor(16)
+
+    def handle(self, handler, path, query, body):
+        if path == "/subscribe" and body:
+            self.reply(handler, 202, "text/plain", b"")
+            self.pool.submit(self.verify, body)
+            return None
+        super().handle(handler, path, query, body)
+
+    def verify(self, form):
+        challenge = secrets.token_hex(8)
+        params = urlencode({
+            "hub.mode": form["hub.mode"],
+            "hub.topic": form["hub.topic"],
+            "hub.challenge": challenge,
+            "hub.lease_seconds": form.get("hub.lease_seconds", "432000"),
+        })
+        try:
+            with urllib.request.urlopen(f"{form['hub.callback']}?{params}", timeout=10) as response:
+                if response.read().decode("utf-8") != challenge:
+                    return
+        except OSError:
+            return
+        with self.lock:
+            subscribers = self.subscriptions.setdefault(form["hub.topic"], {})
+            if form["hub.mode"] == "subscribe":
+                subscribers[form["hub.callback"]] = form.get("hub.secret")
+            else:
+                subscribers.pop(form["hub.callback"], None)
+
+    def verified(self):
+        with self.lock:
+            return sum(len(subscribers) for subscribers in self.subscriptions.values())
+
+    def publish(self, channel_ids):
+        # Like YouTube's hub: one notification per upload to every subscriber
+        list(self.pool.map(self.push, channel_ids))
+
+    def push(self, channel_id):
+        video_id = self.youtube.latest(channel_id)
+        snippet = self.youtube.snippet(video_id)
+        body = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<feed xmlns="http://www.w3.org/2005/Atom" '
+            'xmlns:yt="http://www.youtube.com/xml/schemas/2015">'
+            f"<entry><yt:videoId>{video_id}</yt:videoId><yt:channelId>{channel_id}</yt:channelId>"
+            f"<title>{escape(snippet['title'])}</title>"
+            f"<author><name>{escape(snippet['channelTitle'])}</name></author>"
+            f"<published>{snippet['publishedAt']}</published>"
+            f"<updated>{snippet['publishedAt']}</updated></entry></feed>"
+        ).encode("utf-8")
+        with self.lock:
+            subscribers = dict(self.subscriptions.get(f"{TOPIC_URL}?channel_id={channel_id}", {}))
+        for callback, secret in subscribers.items():
+            headers = {"Content-Type": "application/atom+xml"}
+            if secret:
+                headers["X-Hub-Signature"] = sign(secret, body)
+            request = urllib.request.Request(callback, data=body, headers=headers, method="POST")
+            with urllib.request.urlopen(request, timeout=10):
+                pass
+            with self.lock:
+                self.pushes += 1
+
+
+class FakeTranscripts:
+    # Stands in for transcripts.fetch_from_youtube
+    def __init__(self, latency=0.0, segments=300):
+        self.latency = latency
+        self.segments = segments
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def fetch(self, video_id, languages):
+        with self.lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return languages[0], [
+            {"text": f"{video_id} segment {n} of the transcript", "start": n * 4.0, "duration": 4.0}
+            for n in range(self.segments)
+        ]
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.name = f"Guild {guild_id}"
+
+
+class FakeMessage:
+    def __init__(self, client):
+        self.client = client
+        self.edits = 0
+
+    async def edit(self, embed=None, content=None):
+        await asyncio.sleep(self.client.latency)
+        self.edits += 1
+
+
+class FakeChannel:
+    def __init__(self, client, channel_id):
+        self.client = client
+        self.id = channel_id
+
+    async def send(self, content=None, embed=None, **kwargs):
+        await asyncio.sleep(self.client.latency)
+        self.client.check_rate_limit(self.id)
+        self.client.posts.append((time.monotonic(), self.id, embed.url if embed else content))
+        return FakeMessage(self.client)
+
+
+class FakeDiscord:
+    # Just enough of commands.Bot for the polling loop. Sends are held to
+    # Discord's fixed-window limits: global_limit a second for the bot and 5
+    # per 5 seconds per channel, answering 429 beyond them.
+    def __init__(self, guild_ids, latency=0.0, global_limit=50):
+        self.guilds = [FakeGuild(guild_id) for guild_id in guild_ids]
+        self.shard_count = 1
+        self.latency = latency
+        self.posts = []
+        self.limits = {None: (global_limit, 1.0)}
+        self.windows = {}  # channel_id (None for global) -> [reset_at, remaining]
+        self.rate_limited = 0
+
+    def check_rate_limit(self, channel_id):
+        now = time.monotonic()
+        for key in (None, channel_id):
+            limit, per = self.limits.get(key, (5, 5.0))
+            window = self.windows.get(key)
+            if window is None or now >= window[0]:
+                window = self.windows[key] = [now + per, limit]
+            if window[1] <= 0:
+                self.rate_limited += 1
+                response = SimpleNamespace(status=429, reason="Too Many Requests")
+                raise discord.HTTPException(response, {"message": "You are being rate limited."})
+        for key in (None, channel_id):
+            self.windows[key][1] -= 1
+
+    def get_channel(self, channel_id):
+        return FakeChannel(self, channel_id)
+
+
+class FakeInteraction:
+    # Just enough of discord.Interaction for /summary
+    def __init__(self, client, guild_id):
+        self.guild = FakeGuild(guild_id)
+        self.client = client
+        self.started = time.monotonic()
+        self.first_reply = None
+        self.message = None
+        self.response = self
+        self.followup = self
+
+    async def defer(self, **kwargs):
+        await asyncio.sleep(self.client.latency)
+
+    async def send_message(self, content=None, **kwargs):
+        await self.send(content, **kwargs)
+
+    async def send(self, content=None, embed=None, wait=False, **kwargs):
+        await asyncio.sleep(self.client.latency)
+        if self.first_reply is None:
+            self.first_reply = time.monotonic() - self.started
+        self.message = FakeMessage(self.client)
+        return self.message
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[int(fraction * (len(ordered) - 1))]
+
+
+def call_delta(after, before):
+    return {path: count - before.get(path, 0) for path, count in after.items() if count != before.get(path, 0)}
+
+
+def launch_seconds(runs):
+    # Fresh interpreters, since imports are most of what a restart pays for
+    # before it can connect to Discord
+    code = "import time; start = time.perf_counter(); import bot; print(time.perf_counter() - start)"
+    launches = []
+    imports = []
+    for _ in range(runs):
+        start = time.monotonic()
+        result = subprocess.run(
+            [sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        )
+        launches.append(time.monotonic() - start)
+        imports.append(float(result.stdout.strip().splitlines()[-1]))
+    return statistics.median(launches), statistics.median(imports)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_mongo(args):
+    if args.mongo_uri:
+        client = MongoClient(args.mongo_uri)
+    elif mongomock is not None:
+        client = mongomock.MongoClient()
+    else:
+        sys.exit("Install mongomock or pass --mongo-uri of a local mongod")
+    # Never touch the bot's real database
+    client.drop_database(args.database)
+    return MongoDBWorker("bench-yt-key", "bench-token", client=client, database=args.database)
+
+
+def seed_guilds(mongo, youtube, guild_ids, per_guild, rng, channel_ids=None):
+    # Every guild follows per_guild random channels and has seen their latest upload
+    # (one update per guild: mongomock's bulk_write lags behind pymongo's)
+    channel_ids = channel_ids or list(youtube.channels)
+    for guild_id in guild_ids:
+        monitored = rng.sample(channel_ids, min(per_guild, len(channel_ids)))
+        mongo.servers.update_one({'guild_id': guild_id}, {'$set': {
+            'monitored_channels': monitored,
+            'update_channel': guild_id * 10,
+            'openai_key': f"sk-bench-{guild_id}",
+            'last_video_ids': {channel_id: youtube.latest(channel_id) for channel_id in monitored},
+        }})
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    youtube = YouTubeStub(args.channels, args.youtube_latency, seed=args.seed).start()
+    openai = OpenAIStub(args.openai_latency, args.openai_token_delay, batch_latency=args.batch_latency).start()
+    transcripts = FakeTranscripts(args.transcript_latency)
+    hub = HubStub(youtube).start() if args.websub else None
+    guild_ids = list(range(1, args.guilds + 1))
+    # Past the two /addchannels guilds: guilds that all follow one hot channel
+    hot_ids = list(range(args.guilds + 3, args.guilds + 3 + args.hot_guilds))
+    hot_channel = next(iter(youtube.channels))
+    discord_client = FakeDiscord(guild_ids + hot_ids, args.discord_latency, args.discord_global_limit)
+    mongo = make_mongo(args)
+
+    gpt.client = gpt.OpenAIClient(base_url=f"{openai.url}/v1")
+    # Several workers in one process share the database, each polling only
+    # the partitions it leases, as separate processes would
+    start = time.monotonic()
+    workers = [
+        make_worker(args, f"bench-{n}", mongo, youtube, transcripts, discord_client, hub)
+        for n in range(args.workers)
+    ]
+    quicktube = workers[0]
+    report = {
+        "guilds": args.guilds, "channels_per_guild": args.channels_per_guild, "workers": args.workers,
+        "construct_seconds": (time.monotonic() - start) / args.workers,
+    }
+
+    # initial_sync for a first deploy, every guild new
+    start = time.monotonic()
+    await quicktube.io.run("mongo", mongo.initial_sync, guild_ids + hot_ids)
+    report["initial_sync_seconds"] = time.monotonic() - start
+    seed_guilds(mongo, youtube, guild_ids, args.channels_per_guild, rng)
+    seed_guilds(mongo, youtube, hot_ids, 1, rng, [hot_channel])
+    # Then what on_ready does on every restart before the first sweep
+    start = time.monotonic()
+    await quicktube.prepare()
+    report["prepare_seconds"] = time.monotonic() - start
+    for worker in workers[1:]:
+        await worker.prepare()
+    report["monitored_channels"] = len(quicktube.subscriptions)
+
+    # A few rounds so every worker settles on its fair share of partitions
+    for _ in range(3):
+        for worker in workers:
+            await worker.io.run("mongo", worker.leases.heartbeat)
+    for worker in workers:
+        worker.dispatcher.share(worker.leases.live_workers)
+        worker.pipeline.start()
+    if hub:
+        # Each worker subscribes at the hub for the channels it leases
+        for worker in workers:
+            await worker.websub.start("127.0.0.1", worker.websub_port)
+            await worker.websub.sync(
+                [c for c in worker.subscriptions.channels() if worker.leases.owns(c)]
+            )
+        wanted = sum(len(worker.websub.wanted) for worker in workers)
+        deadline = time.monotonic() + 30
+        while hub.verified() < wanted and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+    sweeps = []
+    for _ in range(args.sweeps):
+        uploaded = set(youtube.upload(args.upload_rate))
+        expected = sum(
+            len(quicktube.subscriptions.subscribers(channel_id))
+            for channel_id in uploaded if channel_id in quicktube.subscriptions.channels()
+        )
+        calls_before = youtube.snapshot()
+        openai_before = openai.snapshot()
+        transcripts_before = transcripts.calls
+        posts_before = len(discord_client.posts)
+        # Every leased channel, the worst case for one sweep
+        owned = [
+            [c for c in worker.subscriptions.channels() if worker.leases.owns(c)]
+            for worker in workers
+        ]
+        start = time.monotonic()
+        if hub:
+            # Uploads arrive as pushes instead of being found by a poll
+            await asyncio.to_thread(hub.publish, sorted(uploaded))
+            await asyncio.gather(*(worker.pipeline.join() for worker in workers))
+            await asyncio.gather(*(worker.dispatcher.join() for worker in workers))
+        else:
+            await asyncio.gather(*(
+                worker.sweep(channel_ids) for worker, channel_ids in zip(workers, owned)
+            ))
+            await asyncio.gather(*(worker.dispatcher.join() for worker in workers))
+        seconds = time.monotonic() - start
+        posts = discord_client.posts[posts_before:]
+        post_times = [posted - start for posted, _, _ in posts]
+        youtube_calls = call_delta(youtube.snapshot(), calls_before)
+        sweeps.append({
+            "seconds": seconds,
+            "channels": sum(len(channel_ids) for channel_ids in owned),
+            "new_uploads": len(uploaded),
+            "posts": len(posts),
+            "expected_posts": expected,
+            "duplicate_posts": len(posts) - len({(channel, url) for _, channel, url in posts}),
+            "youtube_calls": youtube_calls,
+            "youtube_api_calls": sum(
+                count for path, count in youtube_calls.items() if path.startswith("/youtube/")
+            ),
+            "openai_calls": sum(call_delta(openai.snapshot(), openai_before).values()),
+            "transcript_calls": transcripts.calls - transcripts_before,
+            "first_post_seconds": min(post_times) if post_times else None,
+            "p95_post_seconds": percentile(post_times, 0.95),
+        })
+    report["sweeps"] = sweeps
+
+    if hot_ids:
+        # One upload fanned out to every hot guild, through whichever worker owns it
+        owner = next(worker for worker in workers if worker.leases.owns(hot_channel))
+        expected = len(owner.subscriptions.subscribers(hot_channel))
+        posts_before = len(discord_client.posts)
+        rate_limited_before = discord_client.rate_limited
+        video_id = youtube.upload_to(hot_channel)
+        start = time.monotonic()
+        if hub:
+            await asyncio.to_thread(hub.publish, [hot_channel])
+            await owner.pipeline.join()
+            await owner.dispatcher.join()
+        else:
+            await owner.sweep([hot_channel])
+            await owner.dispatcher.join()
+        posted = [
+            posted for posted, _, url in discord_client.posts[posts_before:] if url.endswith(video_id)
+        ]
+        report["hot_channel"] = {
+            "guilds": expected,
+            "posts": len(posted),
+            "seconds": time.monotonic() - start,
+            "last_post_seconds": max(posted) - start if posted else None,
+            "rate_limited": discord_client.rate_limited - rate_limited_before,
+            "dispatcher": owner.dispatcher.stats(),
+        }
+
+    # /summary: distinct videos, so every command misses the summary cache
+    video_ids = rng.sample(list(youtube.videos), min(args.summaries, len(youtube.videos)))
+    guilds = [rng.choice(guild_ids) for _ in video_ids]
+
+    async def summarize_all():
+        interactions = [FakeInteraction(discord_client, guild_id) for guild_id in guilds]
+        await asyncio.gather(*(
+            quicktube.summary(interaction, f"https://www.youtube.com/watch?v={video_id}")
+            for interaction, video_id in zip(interactions, video_ids)
+        ))
+        return interactions
+
+    transcripts_before = transcripts.calls
+    start = time.monotonic()
+    interactions = await summarize_all()
+    first_replies = [i.first_reply for i in interactions if i.first_reply is not None]
+    report["summary"] = {
+        "commands": len(interactions),
+        "seconds": time.monotonic() - start,
+        "p95_first_reply_seconds": percentile(first_replies, 0.95),
+        "edits": sum(i.message.edits for i in interactions if i.message),
+        "transcript_calls": transcripts.calls - transcripts_before,
+    }
+    # The same commands again, then with the summaries dropped so each one is
+    # regenerated; neither should download a transcript a second time
+    transcripts_before = transcripts.calls
+    await summarize_all()
+    report["summary"]["repeat_transcript_calls"] = transcripts.calls - transcripts_before
+    quicktube.summaries.memory.clear()
+    await quicktube.io.run("mongo", mongo.summaries.delete_many, {})
+    await quicktube.io.run("mongo", mongo.chunk_summaries.delete_many, {})
+    transcripts_before = transcripts.calls
+    await summarize_all()
+    report["summary"]["regenerated_transcript_calls"] = transcripts.calls - transcripts_before
+
+    if args.backfill:
+        report["backfill"] = await run_backfill(args, quicktube, youtube, openai, transcripts, discord_client)
+
+    # /addchannels: two new guilds onboarding the same channels, half as
+    # @handles; the second should be served from the resolver cache
+    onboard = rng.sample(sorted(youtube.handles), min(args.onboard, len(youtube.handles)))
+    urls = " ".join(
+        f"https://www.youtube.com/@{handle}" if n % 2 else
+        f"https://www.youtube.com/channel/{youtube.handles[handle]}"
+        for n, handle in enumerate(onboard)
+    )
+    report["onboarding"] = []
+    for guild_id in (args.guilds + 1, args.guilds + 2):
+        await quicktube.io.run("mongo", quicktube.configs.create, guild_id)
+        calls_before = youtube.snapshot()
+        start = time.monotonic()
+        await quicktube.addchannels(FakeInteraction(discord_client, guild_id), urls)
+        report["onboarding"].append({
+            "channels": len(onboard),
+            "added": len(quicktube.configs.get(guild_id)["monitored_channels"]),
+            "seconds": time.monotonic() - start,
+            "youtube_api_calls": sum(call_delta(youtube.snapshot(), calls_before).values()),
+        })
+
+    report["launch_seconds"], report["import_seconds"] = launch_seconds(args.startup_runs)
+    # Launch to the end of on_ready, less the Discord handshake itself
+    report["startup_seconds"] = (
+        report["launch_seconds"] + report["construct_seconds"] + report["prepare_seconds"]
+    )
+    report["transcripts"] = [worker.transcripts.stats() for worker in workers]
+    report["jobs"] = quicktube.jobs.counts()
+    report["leases"] = [worker.leases.stats() for worker in workers]
+    report["detector"] = [worker.detector.stats() for worker in workers]
+    report["quota"] = [worker.quota.snapshot() for worker in workers]
+    if hub:
+        report["websub"] = {
+            "pushes": hub.pushes, "workers": [worker.websub.stats() for worker in workers]
+        }
+    report["peak_rss_mb"] = peak_rss_mb()
+    for worker in workers:
+        await worker.pipeline.stop()
+        if worker.websub:
+            await worker.websub.stop()
+        worker.io.shutdown()
+    if hub:
+        hub.stop()
+    youtube.stop()
+    openai.stop()
+    return report
+
+
+async def run_backfill(args, quicktube, youtube, openai, transcripts, discord_client):
+    # A guild backfills one channel's last N videos, through one batch, then
+    # the same videos as live requests with the same key for comparison
+    channel_id = next(c for c in youtube.channels if c not in quicktube.subscriptions.channels())
+    for _ in range(args.backfill):
+        youtube.upload_to(channel_id)
+    server = quicktube.configs.get(1)
+    key, update_channel = server["openai_key"], server["update_channel"]
+    quicktube.backfills.poll_interval = 0.1
+    calls_before = openai.snapshot()
+    posts_before = len(discord_client.posts)
+    start = time.monotonic()
+    queued, cached = await quicktube.start_backfill(1, update_channel, key, channel_id, args.backfill)
+    summarized = None
+    while True:
+        await quicktube.poll_backfills()
+        if summarized is None and openai.batched_requests >= queued:
+            summarized = time.monotonic() - start
+        counts = await quicktube.io.run("mongo", quicktube.backfills.counts)
+        if not counts[SUBMITTED] and (counts["done"] or counts["failed"]):
+            break
+        await asyncio.sleep(0.05)
+    await quicktube.dispatcher.join()
+    batch = {
+        "videos": queued + cached,
+        "summarized_seconds": summarized,
+        # Posting is held to Discord's 5 per 5 seconds for the one channel
+        "posted_seconds": time.monotonic() - start,
+        "posts": len(discord_client.posts) - posts_before,
+        "openai_requests": sum(call_delta(openai.snapshot(), calls_before).values()),
+        "list_price": 0.5,  # Batch API pricing relative to live requests
+    }
+
+    videos = youtube.channels[channel_id][-args.backfill:]
+    texts = await asyncio.gather(*(
+        quicktube.io.run("transcript", quicktube.fetch_transcript, video_id, 4000)
+        for video_id, _ in videos
+    ))
+    calls_before = openai.snapshot()
+    start = time.monotonic()
+    await asyncio.gather(*(quicktube.io.run("openai", gpt.summarize, text, key) for text in texts))
+    live = {
+        "videos": len(texts),
+        "summarized_seconds": time.monotonic() - start,
+        "openai_requests": sum(call_delta(openai.snapshot(), calls_before).values()),
+        "list_price": 1.0,
+    }
+    return {"batch": batch, "live": live}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def make_worker(args, worker_id, mongo, youtube, transcripts, discord_client, hub=None):
+    quicktube = Quicktube(
+        "bench-yt-key",
+        "bench-token",
+        full_transcripts=args.full_transcripts,
+        metrics_port=0,
+        mongo=mongo,
+        youtube=YouTubeClient("bench-yt-key", api_endpoint=f"{youtube.url}/"),
+        worker_id=worker_id,
+        partitions=args.partitions,
+        discord_global_limit=args.discord_global_limit,
+    )
+    quicktube.detector.feed_url = f"{youtube.url}/feeds/videos.xml"
+    quicktube.detector.use_feed = not args.no_feed
+    quicktube.transcripts = TranscriptStore(
+        os.path.join(args.transcript_dir, worker_id), fetcher=transcripts.fetch
+    )
+    quicktube.bot = discord_client
+    if hub:
+        quicktube.websub_port = free_port()
+        quicktube.websub = PushSubscriber(
+            f"http://127.0.0.1:{quicktube.websub_port}/websub",
+            quicktube.push_upload,
+            hub_url=f"{hub.url}/subscribe",
+        )
+    if not args.mongo_uri:
+        quicktube.configs.watch = lambda: None  # mongomock has no change streams
+    return quicktube
+
+
+def check(report, args):
+    # Returns the list of exceeded thresholds
+    sweeps = report["sweeps"]
+    measured = {
+        "max_sweep_seconds": max((s["seconds"] for s in sweeps), default=0),
+        "max_api_calls": max((s["youtube_api_calls"] for s in sweeps), default=0),
+        "max_post_seconds": max((s["p95_post_seconds"] or 0 for s in sweeps), default=0),
+        "max_summary_seconds": report["summary"]["p95_first_reply_seconds"] or 0,
+        "max_rss_mb": report["peak_rss_mb"],
+        "max_startup_seconds": report["startup_seconds"],
+    }
+    failures = []
+    for name, value in measured.items():
+        limit = getattr(args, name)
+        if limit is not None and value > limit:
+            failures.append(f"{name}: {value:.2f} > {limit}")
+    missing = sum(s["expected_posts"] - s["posts"] for s in sweeps)
+    if missing > 0:
+        failures.append(f"{missing} expected posts never appeared")
+    for onboarding in report["onboarding"]:
+        if onboarding["added"] < onboarding["channels"]:
+            failures.append(f"/addchannels added {onboarding['added']} of {onboarding['channels']} channels")
+    hot = report.get("hot_channel")
+    if hot and hot["posts"] < hot["guilds"]:
+        failures.append(f"hot channel posted to {hot['posts']} of {hot['guilds']} guilds")
+    if hot and args.max_hot_seconds is not None and hot["seconds"] > args.max_hot_seconds:
+        failures.append(f"max_hot_seconds: {hot['seconds']:.2f} > {args.max_hot_seconds}")
+    summary = report["summary"]
+    refetched = summary["repeat_transcript_calls"] + summary["regenerated_transcript_calls"]
+    if refetched:
+        failures.append(f"{refetched} transcripts were downloaded again for repeat /summary commands")
+    duplicates = sum(s["duplicate_posts"] for s in sweeps)
+    if duplicates:
+        failures.append(f"{duplicates} videos were posted more than once")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Quicktube against local stand-ins.")
+    parser.add_argument("--guilds", type=int, default=100, help="Number of guilds (N)")
+    parser.add_argument("--channels-per-guild", type=int, default=5, help="Channels each guild follows (M)")
+    parser.add_argument("--channels", type=int, default=250, help="Unique YouTube channels to draw from")
+    parser.add_argument("--upload-rate", type=float, default=0.05, help="Chance a channel uploads before each sweep")
+    parser.add_argument("--sweeps", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=1, help="Poller workers sharing the channels")
+    parser.add_argument("--partitions", type=int, default=64)
+    parser.add_argument("--summaries", type=int, default=10, help="Concurrent /summary commands")
+    parser.add_argument("--onboard", type=int, default=100, help="Channels given to one /addchannels")
+    parser.add_argument("--full-transcripts", action="store_true")
+    parser.add_argument("--no-feed", action="store_true", help="Poll uploads playlists instead of feeds")
+    parser.add_argument("--websub", action="store_true", help="Take uploads from a local WebSub hub, not sweeps")
+    parser.add_argument("--youtube-latency", type=float, default=0.02)
+    parser.add_argument("--transcript-latency", type=float, default=0.05)
+    parser.add_argument("--openai-latency", type=float, default=0.2)
+    parser.add_argument("--openai-token-delay", type=float, default=0.01)
+    parser.add_argument("--discord-latency", type=float, default=0.01)
+    parser.add_argument("--backfill", type=int, default=0, help="Videos to backfill, in a batch and live")
+    parser.add_argument("--batch-latency", type=float, default=2.0, help="Seconds until a stub batch completes")
+    parser.add_argument("--discord-global-limit", type=int, default=50, help="Discord requests per second")
+    parser.add_argument("--hot-guilds", type=int, default=0, help="Extra guilds that all follow one channel")
+    parser.add_argument("--mongo-uri", help="Local mongod to use instead of mongomock")
+    parser.add_argument("--database", default="QuickTubeBenchmark", help="Dropped before every run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the report to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="Show the bot's own output")
+    parser.add_argument("--max-sweep-seconds", type=float)
+    parser.add_argument("--max-api-calls", type=int, help="YouTube Data API calls per sweep")
+    parser.add_argument("--max-post-seconds", type=float, help="p95 time from sweep start to post")
+    parser.add_argument("--max-summary-seconds", type=float, help="p95 time to the first /summary reply")
+    parser.add_argument("--max-hot-seconds", type=float, help="Hot channel upload to its last post")
+    parser.add_argument("--max-rss-mb", type=float)
+    parser.add_argument("--max-startup-seconds", type=float, help="Launch until on_ready has finished")
+    parser.add_argument("--startup-runs", type=int, default=3, help="Fresh interpreters to time imports in")
+    args = parser.parse_args()
+
+    # The bot logs every channel it checks, which would drown out the report
+    # Each run starts with no stored transcripts
+    with tempfile.TemporaryDirectory() as args.transcript_dir, open(os.devnull, "w") as devnull:
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull)
+        with output:
+            report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    failures = check(report, args)
+    for failure in failures:
+        print(f"FAIL {failure}", file=sys.stderr)
+    # The stand-in servers and pool threads are daemons
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,65 +3,204 @@ from discord.ext import commands
 from discord import app_commands
 import asyncio
 import argparse
+import hashlib
+import json
+import time
 import re
-from bson.objectid import ObjectId
-from googleapiclient.discovery import build
-from youtube_transcript_api import YouTubeTranscriptApi
-from gpt import summarize
-from utils import (
-    extract_video_id_from_url,
-    extract_channel_identifier_from_url,
-    get_channel_id_from_name,
-    get_channel_name,
+import gpt
+import metrics
+from gpt import (
+    MODEL,
+    chunk_prefix,
+    prefix,
+    reduce_transcript,
+    summarize,
+    summarize_long,
+    summarize_stream,
 )
+from utils import extract_video_id_from_url, parse_channel_url, split_channel_urls
 from mongo_worker import MongoDBWorker
+from config_store import GuildConfigStore
+from poller import SubscriptionIndex
+from scheduler import PollScheduler
+from detector import UploadDetector
+from rate_limit import QuotaCounter, QuotaExhausted
+from metadata import ChannelMetadataCache, ChannelResolver, VideoDetailsBatcher
+from io_pool import IOPool
+from youtube_client import YouTubeClient
+from transcripts import DEFAULT_LANGUAGES, TranscriptStore
+from websub import HUB_URL, PushSubscriber
+from dispatcher import FanoutDispatcher
+from pipeline import Pipeline
+from leases import PartitionLeases
+from job_queue import SummaryJobQueue
+from backfill import DONE, FAILED, MAX_VIDEOS, BackfillQueue
+from summary_cache import ChunkStore, SummaryCache, summary_key
 
 EMBED_COLOR = 0xE04141
+EMBED_DESCRIPTION_LIMIT = 4096
+QUOTA_MESSAGE = "The daily YouTube API quota has run out. Please try again later."
 
 # TODO make sure only admins can change config
 
 class Quicktube:
-    def __init__(self, yt_api_key, discord_token):
-        self.mongo = MongoDBWorker(yt_api_key, discord_token)
+    def __init__(
+        self, yt_api_key, discord_token, full_transcripts=False, youtube_quota=10000,
+        metrics_port=9108, mongo=None, youtube=None, worker_id=None, partitions=64,
+        shard_count=None, shard_ids=None, transcript_dir="transcripts", transcript_cache_mb=512,
+        transcript_languages=DEFAULT_LANGUAGES, websub_callback=None, websub_port=8080,
+        websub_secret=None, websub_hub=HUB_URL, websub_poll_interval=6 * 60 * 60,
+        discord_global_limit=50,
+    ):
+        # mongo and youtube can be passed in to run against local stand-ins (see benchmark.py)
+        self.mongo = mongo or MongoDBWorker(yt_api_key, discord_token)
         self.yt_api_key = yt_api_key
         self.discord_token = discord_token
-        self.check_interval = 600  # 10 minutes
-        self.youtube = build("youtube", "v3", developerKey=self.yt_api_key)
+        self.check_interval = 600  # 10 minutes, used until a channel has upload history
+        self.scheduler_tick = 30  # how often new subscriptions get picked up
+        self.stream_edit_interval = 1.5  # seconds between /summary edits, inside Discord's limits
+        self.metrics_port = metrics_port  # Prometheus /metrics endpoint, 0 to disable
+        self.scheduler = PollScheduler(default_interval=self.check_interval)
+        self.io = IOPool()
+        self.summaries = SummaryCache(self.mongo.summaries, self.io)
+        # Summarize whole transcripts with chunked map-reduce instead of the first 4000 characters
+        self.full_transcripts = full_transcripts
+        self.chunk_store = ChunkStore(self.mongo.chunk_summaries)
+        self.configs = GuildConfigStore(self.mongo)
+        # Channels are polled by whichever worker process holds their partition's lease
+        self.leases = PartitionLeases(self.mongo, worker_id, partitions)
+        # Durable record of every video still to be summarized and posted
+        self.jobs = SummaryJobQueue(self.mongo.jobs)
+        # Back catalogues go through the OpenAI Batch API instead of live requests
+        self.backfills = BackfillQueue(self.mongo.backfills)
+        self.backfill_tasks = set()
+        # Set when this process runs only some of the bot's shards
+        self.shard_ids = shard_ids
+        # Built on first use from the pinned discovery document
+        self.youtube = youtube or YouTubeClient(self.yt_api_key)
+        self.transcripts = TranscriptStore(transcript_dir, transcript_cache_mb * 1024 * 1024)
+        self.transcript_languages = tuple(transcript_languages)  # in order of preference
+        self.subscriptions = SubscriptionIndex()
+        self.subscriptions_generation = None
+        # Spent from one budget in Mongo by every worker using this API key
+        self.quota = QuotaCounter(
+            daily_units=youtube_quota, collection=self.mongo.youtube_quota,
+            key_id=hashlib.sha256(yt_api_key.encode("utf-8")).hexdigest()[:16],
+        )
+        # Uploads pushed by a WebSub hub to a public callback URL, if given;
+        # pushed channels are then only polled every websub_poll_interval
+        self.websub = None
+        self.websub_port = websub_port
+        if websub_callback:
+            self.websub = PushSubscriber(
+                websub_callback, self.push_upload, hub_url=websub_hub, secret=websub_secret
+            )
+            self.scheduler.push_interval = websub_poll_interval
+        self.channels = ChannelMetadataCache(self.youtube, self.quota)
+        self.resolver = ChannelResolver(self.youtube, self.mongo.handles, self.io, self.quota)
+        self.detector = UploadDetector(self.youtube, self.quota, self.channels)
+        self.videos = VideoDetailsBatcher(self.youtube, self.io, self.quota)
+        # Summary posts go out concurrently, inside Discord's rate limits
+        self.dispatcher = FanoutDispatcher(global_limit=discord_global_limit)
+        self.stage_workers = {"detect": 4, "transcript": 4, "summarize": 4, "post": 4}
+        self.pipeline = self.build_pipeline()
+        self.poll_task = None
         intents = discord.Intents.default()
         intents.message_content = True
-        self.bot = commands.Bot(command_prefix="!", intents=intents)
+        self.bot = commands.AutoShardedBot(
+            command_prefix="!", intents=intents, shard_count=shard_count, shard_ids=shard_ids
+        )
 
         @self.bot.event
         async def on_ready():
             print(f"{self.bot.user} has connected to Discord!")
-            await self.bot.tree.sync()  # Sync here, after the bot is ready
-            # Start checking for new videos here
-            print("Syncing databases...")
-            try:
-                self.mongo.initial_sync([guild.id for guild in self.bot.guilds])
-            except Exception as e:
-                print(f"Error during initial sync: {e}")
-
-            print("Databases synced.")
-            # print out a list of guilds and their monitored channels
-            for guild in self.bot.guilds:
-                print(f"Guild: {guild.name}")
-                server = self.mongo.get_server(guild.id)
-                print(server)
-                if server:
-                    print(f"Monitored Channels: {server['monitored_channels']}")
-                else:
-                    print("No server entry found.")
-            asyncio.create_task(self.check_new_videos())
+            start = time.monotonic()
+            await self.sync_commands()
+            await self.prepare()
+            print(f"Ready in {time.monotonic() - start:.1f}s after connecting.")
+            # Start checking for new videos here; on_ready fires again after
+            # reconnects, but there is only ever one poll loop
+            if self.poll_task is None or self.poll_task.done():
+                self.poll_task = asyncio.create_task(self.check_new_videos())
 
         self.setup_commands()
 
         @self.bot.event
         async def on_guild_join(guild):
             print(f"Joined a new guild: {guild.name}")
-            if not self.mongo.server_exists(guild.id):
-                self.mongo.new_server(guild.id)
+            await self.io.run("mongo", self.configs.create, guild.id)
+            await self.io.run("mongo", self.configs.set_active, guild.id, True)
 
+        @self.bot.event
+        async def on_guild_remove(guild):
+            print(f"Removed from guild: {guild.name}")
+            # Kept in Mongo but marked inactive, so no worker subscribes it again
+            await self.io.run("mongo", self.configs.set_active, guild.id, False)
+            self.subscriptions.remove_guild(guild.id)
+
+    async def sync_commands(self):
+        # Registering slash commands is a slow, rate-limited call, so it only
+        # happens when their definitions changed since the last deploy
+        tree = self.bot.tree
+        commands_json = json.dumps(
+            [command.to_dict(tree) for command in tree.get_commands()], sort_keys=True, default=str
+        )
+        digest = hashlib.sha256(commands_json.encode("utf-8")).hexdigest()
+        # Commands are registered per application, and several (staging,
+        # production) may share a database
+        key = f"commands:{self.bot.application_id}"
+        try:
+            synced = await self.io.run("mongo", self.mongo.get_meta, key)
+        except Exception as e:
+            print(f"Could not read the synced command hash: {e}")
+            synced = None
+        if synced == digest:
+            print("Slash commands unchanged, skipping sync.")
+            return
+        await tree.sync()
+        await self.io.run("mongo", self.mongo.set_meta, key, digest)
+
+    async def prepare(self):
+        # Everything between connecting and the first poll
+        print("Syncing databases...")
+        try:
+            await self.io.run(
+                "mongo", self.mongo.initial_sync, [guild.id for guild in self.bot.guilds],
+                self.shard_ids, self.bot.shard_count,
+            )
+        except Exception as e:
+            print(f"Error during initial sync: {e}")
+
+        # Load every guild config into memory and follow outside edits
+        await self.io.run("mongo", self.configs.load)
+        self.configs.watch()
+        await self.io.run("mongo", self.leases.setup)
+        await self.io.run("mongo", self.leases.heartbeat)
+        self.leases.start()
+        await self.io.run("mongo", self.jobs.setup)
+        await self.io.run("mongo", self.backfills.setup)
+        await self.io.run("mongo", self.jobs.recover, self.leases.worker_id)
+        await self.io.run("mongo", self.resolver.setup)
+        await self.io.run("mongo", self.quota.setup)
+        await self.io.run("mongo", self.quota.load)
+        print(f"Worker {self.leases.worker_id} holds {len(self.leases.owned)} partitions.")
+        print("Databases synced.")
+        self.rebuild_subscriptions()
+        print(f"Monitoring {len(self.subscriptions)} unique YouTube channels.")
+        # Warm the channel metadata cache in batches of 50; the first call also
+        # builds the YouTube client, off the event loop
+        try:
+            await self.io.run("youtube", self.channels.get_many, self.subscriptions.channels())
+        except Exception as e:
+            print(f"Error loading channel metadata: {e}")
+        # print out a list of guilds and their monitored channels
+        for guild in self.bot.guilds:
+            print(f"Guild: {guild.name}")
+            server = self.configs.get(guild.id)
+            if server:
+                print(f"Monitored Channels: {server['monitored_channels']}")
+            else:
+                print("No server entry found.")
 
     @app_commands.describe(
         channel="Channel to post summaries (optional)",
@@ -72,6 +211,9 @@ class Quicktube:
         self.bot.tree.command(
             name="addchannel", description="Add a YouTube channel to monitor"
         )(self.addchannel)
+        self.bot.tree.command(
+            name="addchannels", description="Add many YouTube channels to monitor at once"
+        )(self.addchannels)
         self.bot.tree.command(
             name="removechannel", description="Remove a YouTube channel from monitoring"
         )(self.removechannel)
@@ -84,224 +226,637 @@ class Quicktube:
         self.bot.tree.command(
             name="listchannels", description="List all currently monitored channels"
         )(self.listchannels)
+        self.bot.tree.command(
+            name="backfill", description="Summarize a channel's latest videos in one batch"
+        )(self.backfill)
 
     async def start(self):
-        youtube = build("youtube", "v3", developerKey=self.yt_api_key)
-        await self.bot.start(self.discord_token)
+        if self.metrics_port:
+            await metrics.start_server(port=self.metrics_port)
+        if self.websub:
+            await self.websub.start(port=self.websub_port)
+        try:
+            await self.bot.start(self.discord_token)
+        finally:
+            # Let the other workers take over our partitions right away
+            self.leases.stop()
+            if self.websub:
+                await self.websub.stop()
 
     def get_latest_video_id(self, channel_id):
-        request = self.youtube.search().list(
-            part="snippet", channelId=channel_id, maxResults=1, order="date"
+        return self.detector.get_latest_video(channel_id)
+
+    def build_pipeline(self):
+        # detect -> transcript -> summarize -> post, each stage with its own workers
+        return (
+            Pipeline()
+            .add_stage("detect", self.detect_stage, self.stage_workers["detect"])
+            .add_stage("transcript", self.transcript_stage, self.stage_workers["transcript"])
+            .add_stage("summarize", self.summarize_stage, self.stage_workers["summarize"])
+            .add_stage("post", self.post_stage, self.stage_workers["post"])
         )
-        response = request.execute()
-
-        if response["items"]:
-            item = response["items"][0]
-            video_id = item["id"]["videoId"]
-            snippet = item["snippet"]
-            video_title = snippet["title"]
-            channel_title = snippet["channelTitle"]
-            thumbnail_url = snippet["thumbnails"]["high"]["url"]
-            video_url = f"https://www.youtube.com/watch?v={video_id}"
-            publish_date = snippet["publishedAt"]
-            return (
+
+    async def check_new_videos(self):
+        self.pipeline.start()
+        while True:
+            try:
+                delay = await self.poll_once()
+            except Exception as e:
+                # A Mongo failover or similar mustn't end polling for good
+                print(f"Error in the poll loop: {e}")
+                delay = self.scheduler_tick
+            await asyncio.sleep(delay)
+
+    async def poll_once(self):
+        # One pass of the poll loop; returns how long to sleep before the next
+        # Pick up configs edited outside the bot; built from memory, no database reads
+        if self.configs.generation != self.subscriptions_generation:
+            self.rebuild_subscriptions()
+        # Only the channels in partitions this worker currently leases
+        channel_ids = [c for c in self.subscriptions.channels() if self.leases.owns(c)]
+        self.scheduler.sync(channel_ids)
+        self.detector.forget(channel_ids)
+        if self.websub:
+            # Subscriptions follow the leases, so each push goes to the owner
+            await self.websub.sync(channel_ids)
+            self.scheduler.pushed = self.websub.active()
+        metrics.MONITORED_CHANNELS.set(len(self.scheduler))
+        # Poll less often instead of failing when the quota budget runs low
+        await self.io.run("mongo", self.quota.load)
+        self.scheduler.slowdown = self.quota.poll_slowdown()
+        self.dispatcher.share(self.leases.live_workers)
+        await self.drain_jobs()
+        await self.poll_backfills()
+        # Only channels whose adaptive poll time has come up
+        channel_ids = self.scheduler.due()
+        if channel_ids:
+            await self.sweep(channel_ids)
+        return min(self.scheduler.seconds_until_next(), self.scheduler_tick)
+
+    def rebuild_subscriptions(self):
+        # Read first, so a change landing mid-rebuild is picked up next tick
+        self.subscriptions_generation = self.configs.generation
+        self.subscriptions.rebuild(self.configs.subscriptions(self.polled_guild_ids()))
+
+    def polled_guild_ids(self):
+        # With shards split over processes this one only sees some guilds,
+        # but the channels it leases can be followed from any of them
+        if self.shard_ids is not None:
+            return None
+        return [guild.id for guild in self.bot.guilds]
+
+    async def sweep(self, channel_ids):
+        print(f"checking {len(channel_ids)} of {len(self.scheduler)} channels")
+        sweep_start = time.monotonic()
+        self.pipeline.reset_stats()
+        # Poll every unique YouTube channel once, then fan out to each subscribed guild
+        for channel_id in channel_ids:
+            await self.pipeline.submit(channel_id)
+        # Posts carry on in the dispatcher; backfills can keep a channel busy for minutes
+        await self.pipeline.join()
+        sweep_seconds = time.monotonic() - sweep_start
+        metrics.SWEEP_SECONDS.observe(sweep_seconds)
+        metrics.SWEEP_CHANNELS.set(len(channel_ids))
+        metrics.CHECK_INTERVAL.set(self.check_interval)
+        print(f"Polled {len(channel_ids)} channels in {sweep_seconds:.1f}s")
+        print(f"YouTube quota used so far: {self.quota.snapshot()}")
+        print(f"I/O latency: {self.io.stats()}")
+        print(f"Pipeline: {self.pipeline.stats()}")
+        print(f"Summary cache: {self.summaries.stats()}")
+        print(f"OpenAI client: {gpt.client.stats()}")
+        print(f"Scheduler: {self.scheduler.stats()}")
+        print(f"Upload detector: {self.detector.stats()}")
+        print(f"Leases: {self.leases.stats()}")
+        print(f"Transcripts: {self.transcripts.stats()}")
+        print(f"Channel resolver: {self.resolver.stats()}")
+        print(f"Discord posts: {self.dispatcher.stats()}")
+        if self.websub:
+            print(f"WebSub: {self.websub.stats()}")
+        return sweep_seconds
+
+    async def drain_jobs(self, limit=50):
+        # Resumes jobs left behind by crashed or restarted workers, and retries
+        await self.io.run("mongo", self.jobs.expire)
+        for _ in range(limit):
+            doc = await self.io.run("mongo", self.jobs.claim, self.leases.worker_id)
+            if doc is None:
+                break
+            print(f"Resuming summary job for video ID {doc['_id']} (attempt {doc['attempts']}).")
+            await self.pipeline.submit(self.job_from_doc(doc), stage="transcript")
+
+    def job_from_doc(self, doc):
+        # OpenAI keys stay out of the job collection and come from the configs
+        targets = []
+        posted = set(doc.get("posted", ()))
+        for guild_id, update_channel in doc["targets"]:
+            if guild_id in posted:
+                continue  # a retry only goes to the guilds that are still missing it
+            openai_key = self.configs.get_openai_key(guild_id)
+            if openai_key and openai_key != "None":
+                targets.append((guild_id, update_channel, openai_key))
+        return {
+            "channel_id": doc["channel_id"],
+            "video_id": doc["_id"],
+            "video": tuple(doc["video"]),
+            "targets": targets,
+        }
+
+    async def push_upload(self, channel_id, video):
+        # A hub pushed an upload: straight into the pipeline, no poll needed
+        await self.pipeline.submit((channel_id, video))
+
+    async def detect_stage(self, item):
+        # A channel ID to poll, or a (channel_id, video) pair pushed by the hub
+        channel_id, latest = item if isinstance(item, tuple) else (item, None)
+        publish_date = None
+        try:
+            if latest is None:
+                latest = await self.io.run("youtube", self.get_latest_video_id, channel_id)
+            (
                 video_id,
                 video_title,
                 channel_title,
                 thumbnail_url,
                 video_url,
                 publish_date,
+            ) = latest
+        finally:
+            # Reschedule from the upload history, even when the lookup fails
+            self.scheduler.record(channel_id, publish_date)
+        # Check to see if the video ID is valid
+        if not video_id:
+            print(f"Could not get latest video ID for channel {channel_id}.")
+            return None
+        targets = []
+        for guild_id, update_channel in self.subscriptions.subscribers(channel_id):
+            # Get the server configuration
+            server = self.configs.servers.get(guild_id)
+            if not server:
+                print(f"Fatal error: server entry does not exist for guild {guild_id}. Please contact the bot owner.")
+                continue
+            # Check to see if the server has a channel configured
+            if not update_channel or update_channel == "None":
+                print(f"Server {guild_id} does not have a channel configured.")
+                continue
+            # Check for openai key
+            if not server['openai_key'] or server['openai_key'] == "None":
+                print(f"OpenAI key not configured for server {guild_id}.")
+                continue
+            # Check to see if the video ID is different from the last video ID
+            last_video_ids = server.get('last_video_ids')
+            if isinstance(last_video_ids, dict) and last_video_ids.get(channel_id) == video_id:
+                print(f"No new videos for channel {channel_title} in server {guild_id}.")
+                continue
+            targets.append((guild_id, update_channel, server['openai_key']))
+        if not targets:
+            return None
+        # From here the job is durable: if this worker dies it stays in Mongo
+        # for another one to pick up. Detection details are carried along so
+        # no second lookup is needed.
+        video = (video_title, channel_title, thumbnail_url, video_url, publish_date)
+        pending = await self.io.run(
+            "mongo", self.jobs.enqueue, video_id, channel_id, video,
+            [(guild_id, update_channel) for guild_id, update_channel, _ in targets],
+        )
+        # The job now owns delivery, retries included, so later polls needn't
+        # look at this video again; posts are deduplicated on the job itself
+        await self.io.run(
+            "mongo", self.configs.mark_seen,
+            [guild_id for guild_id, _, _ in targets], channel_id, video_id,
+        )
+        if not pending:
+            # Already queued, running elsewhere, or failed for good; a claim
+            # can't succeed, and drain_jobs picks up anything that comes due
+            return None
+        doc = await self.io.run("mongo", self.jobs.claim, self.leases.worker_id, video_id)
+        return self.job_from_doc(doc) if doc else None
+
+    async def transcript_stage(self, job):
+        if not job["targets"]:
+            await self.io.run("mongo", self.jobs.complete, job["video_id"], self.leases.worker_id)
+            return None
+        # Skip the transcript entirely when the summary is already cached
+        job["summary"] = await self.summaries.get(self.summary_key(job["video_id"]))
+        job["transcript"] = None
+        if not job["summary"]:
+            job["transcript"] = await self.io.run(
+                "transcript", self.fetch_transcript, job["video_id"], self.transcript_length()
+            )
+            if not job["transcript"]:
+                print(f"Could not fetch transcript text for video ID {job['video_id']}.")
+                await self.io.run(
+                    "mongo", self.jobs.fail, job["video_id"], self.leases.worker_id, "no transcript"
+                )
+                return None
+        # Only fall back to a (batched) videos().list when detection left gaps
+        if None in job["video"]:
+            video_details = await self.videos.get(job["video_id"])
+            if not video_details:
+                print(f"Could not fetch video details for video ID {job['video_id']}.")
+                await self.io.run(
+                    "mongo", self.jobs.fail, job["video_id"], self.leases.worker_id, "no video details"
+                )
+                return None
+            job["video"] = video_details
+        return job
+
+    async def summarize_stage(self, job):
+        if job["summary"]:
+            return job
+        # One summary per video for every subscriber, paid for with the first
+        # guild key that works; other jobs for the same video share it in flight
+        for guild_id, update_channel, openai_key in job["targets"]:
+            try:
+                job["summary"] = await self.summaries.get_or_create(
+                    self.summary_key(job["video_id"]),
+                    lambda openai_key=openai_key: self.io.run(
+                        "openai", self.summarize_transcript, job["transcript"], openai_key
+                    ),
+                )
+            except Exception as e:
+                print(f"Could not summarize video ID {job['video_id']} for server {guild_id}: {e}")
+                continue
+            if job["summary"]:
+                return job
+        raise RuntimeError(f"No summary for video ID {job['video_id']}")
+
+    async def post_stage(self, job):
+        # The embed is built once and shared by every subscriber; the job is
+        # done once each of them has been posted to (or given up on)
+        embed = self.build_embed(job["video"], job["summary"])
+        job["progress"] = {"remaining": len(job["targets"]), "failed": 0}
+        await asyncio.gather(*(self.post_target(job, target, embed) for target in job["targets"]))
+
+    def build_embed(self, video, summary):
+        video_title, channel_title, thumbnail_url, video_url, publish_date = video
+        embed = discord.Embed(
+            title=f"Summary: {video_title}",
+            url=video_url,
+            description=summary,
+            color=EMBED_COLOR,
+        )
+        embed.set_author(name=channel_title)
+        embed.set_thumbnail(url=thumbnail_url)
+        embed.add_field(name="Published Date", value=publish_date, inline=False)
+        return embed
+
+    def discord_channel(self, channel_id):
+        # The guild may sit on a shard run by another process, so fall back
+        # to a REST-only channel handle
+        return self.bot.get_channel(channel_id) or self.bot.get_partial_messageable(channel_id)
+
+    async def post_target(self, job, target, embed):
+        guild_id, update_channel, openai_key = target
+        # Claim the post before sending it; whether two workers' leases overlap
+        # or a retried job comes round again, each guild gets the video once
+        claimed = await self.io.run("mongo", self.jobs.claim_post, job["video_id"], guild_id)
+        if not claimed:
+            await self.finish_target(job)
+            return
+        channel = self.discord_channel(update_channel)
+
+        async def delivered(error):
+            # The claim above is the record of a delivery; a post that gave
+            # up hands it back so the job's retry can send it again
+            if error is not None:
+                print(f"Could not post video ID {job['video_id']} to server {guild_id}: {error}")
+                await self.io.run("mongo", self.jobs.release_post, job["video_id"], guild_id)
+                job["progress"]["failed"] += 1
+            await self.finish_target(job)
+
+        self.dispatcher.submit(
+            update_channel,
+            lambda: self.io.timed("discord", channel.send(embed=embed)),
+            delivered,
+        )
+
+    async def finish_target(self, job):
+        job["progress"]["remaining"] -= 1
+        if job["progress"]["remaining"] > 0:
+            return
+        if job["progress"]["failed"]:
+            # Back in the queue; guilds already posted to keep their claims
+            await self.io.run(
+                "mongo", self.jobs.fail, job["video_id"], self.leases.worker_id, "post failed"
             )
         else:
-            return None, None, None, None, None, None
+            await self.io.run("mongo", self.jobs.complete, job["video_id"], self.leases.worker_id)
 
-    async def check_new_videos(self):
+    def backfill_key(self, video_id):
+        # Backfills summarize the first 4000 characters, like the default live mode
+        return summary_key(video_id, MODEL, prefix)
+
+    async def start_backfill(self, guild_id, update_channel, openai_key, channel_id, count):
+        # Returns (videos sent to a batch, videos posted straight from the summary cache)
+        videos = await self.io.run("youtube", self.detector.recent_uploads, channel_id, count)
+        videos.reverse()  # posted oldest first
+        summaries = await asyncio.gather(
+            *(self.summaries.get(self.backfill_key(video[0])) for video in videos)
+        )
+        cached = [(video, summary) for video, summary in zip(videos, summaries) if summary]
+        for video, summary in cached:
+            self.dispatcher.submit(update_channel, self.sender(update_channel, video, summary))
+        missing = [video for video, summary in zip(videos, summaries) if not summary]
+        texts = await asyncio.gather(
+            *(self.io.run("transcript", self.fetch_transcript, video[0], 4000) for video in missing)
+        )
+        contents = {video[0]: text for video, text in zip(missing, texts) if text}
+        if contents:
+            batch = await self.io.run("openai", gpt.submit_batch, contents, openai_key)
+            await self.io.run(
+                "mongo", self.backfills.add, batch["id"], guild_id, update_channel,
+                [video for video in missing if video[0] in contents],
+            )
+            print(f"Backfill batch {batch['id']} for server {guild_id}: {len(contents)} videos.")
+        return len(contents), len(cached)
+
+    def sender(self, update_channel, video, summary):
+        embed = self.build_embed(video, summary)
+        channel = self.discord_channel(update_channel)
+        return lambda: self.io.timed("discord", channel.send(embed=embed))
+
+    async def poll_backfills(self):
+        # Checks every batch that is due; finished ones are stored and posted
+        # in the background so slow channels don't hold up the loop
         while True:
-            print("checking")
-            #iterate through every guild id
-            for guild in self.bot.guilds:
-                print()
-                guild_id = guild.id
-                # Check to see if the server entry exists
-                if not self.mongo.server_exists(guild_id):
-                    # Throw fatal error
-                    print(f"Fatal error: server entry does not exist for guild {guild.name}. Please contact the bot owner.")
-                    continue
-                # Get the server configuration
-                server = self.mongo.get_server(guild_id)
-                # Check to see if the server has a channel configured
-                if not server['update_channel']:
-                    print(f"Server {guild.name} does not have a channel configured.")
-                    continue
-                # Check to see if the server has an OpenAI key configured
-                if not server['openai_key']:
-                    print(f"Server {guild.name} does not have an OpenAI key configured.")
-                    continue
-                # Check to see if the server has any monitored channels
-                print(server['monitored_channels'])
-                if (not server['monitored_channels']) or (len(server['monitored_channels']) == 0):
-                    print(f"Server {guild.name} does not have any monitored channels.")
+            doc = await self.io.run("mongo", self.backfills.claim, self.leases.worker_id)
+            if doc is None:
+                return
+            openai_key = self.configs.get_openai_key(doc["guild_id"])
+            if not openai_key or openai_key == "None":
+                await self.io.run("mongo", self.backfills.finish, doc["_id"], FAILED, error="no OpenAI key")
+                continue
+            try:
+                batch = await self.io.run("openai", gpt.get_batch, doc["_id"], openai_key)
+                if batch["status"] in gpt.BATCH_OPEN:
+                    await self.io.run("mongo", self.backfills.wait, doc["_id"])
                     continue
-                # Iterate through every monitored channel
-                for channel_id in server['monitored_channels']:
-                    # Get the latest video ID
-                    (
-                        video_id,
-                        video_title,
-                        channel_title,
-                        thumbnail_url,
-                        video_url,
-                        publish_date,
-                    ) = self.get_latest_video_id(channel_id)
-                    print('ah')
-                    # Check to see if the video ID is valid
-                    if not video_id:
-                        print(f"Could not get latest video ID for channel {channel_title}.")
-                        continue
-                    # Check to see if the video ID is different from the last video ID
-                    if len(server['last_video_ids']) >= 1 and server['last_video_ids'][channel_id] and video_id == server['last_video_ids'][channel_id]:
-                        print(f"No new videos for channel {channel_title}.")
-                        continue
-
-                    #Check for openai key
-                    if not server['openai_key'] or server['openai_key'] == "None":
-                        print(f"OpenAI key not configured for server {guild.name}.")
-                        continue
-                    # Get the transcript text
-                    transcript_text = self.fetch_transcript(video_id)
-                    # Check to see if the transcript text is valid
-                    if not transcript_text:
-                        print(f"Could not fetch transcript text for video ID {video_id}.")
-                        continue
-                    # Summarize the transcript text
-                    summary_text = summarize(transcript_text, server['openai_key'])
-                    # Check to see if the summary text is valid
-                    print("prepping embed")
-                    video_details = self.get_video_details(video_id)
-                    if video_details:
-                        (
-                            video_title,
-                            channel_title,
-                            thumbnail_url,
-                            video_url,
-                            publish_date,
-                        ) = video_details
-                        embed = discord.Embed(
-                            title=f"Summary: {video_title}",
-                            url=video_url,
-                            description=summary_text,
-                            color=EMBED_COLOR,
-                        )
-                        embed.set_author(name=channel_title)
-                        embed.set_thumbnail(url=thumbnail_url)
-                        embed.add_field(
-                            name="Published Date", value=publish_date, inline=False
-                        )
-                        channel = self.bot.get_channel(server['update_channel'])
-                        if channel:
-                            await channel.send(embed=embed)
-                        # update the last video ID field
-                        server['last_video_ids'][channel_id] = video_id
-                        # sync with mongo
-                        self.mongo.servers.replace_one({'_id': ObjectId(server['_id'])}, server)
-                    else:
-                        await interaction.followup.send(
-                            "Could not fetch video details for video {video_title}."
-                        )
-            await asyncio.sleep(self.check_interval)
-            
+                results = await self.io.run("openai", gpt.batch_results, batch, openai_key)
+            except Exception as e:
+                print(f"Could not check backfill batch {doc['_id']}: {e}")
+                await self.io.run("mongo", self.backfills.wait, doc["_id"])
+                continue
+            task = asyncio.create_task(self.finish_backfill(doc, batch, results))
+            self.backfill_tasks.add(task)
+            task.add_done_callback(self.backfill_finished)
+
+    def backfill_finished(self, task):
+        self.backfill_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            # The lease runs out and another poll picks the batch up again
+            print(f"Error finishing backfill: {task.exception()!r}")
+
+    async def finish_backfill(self, doc, batch, results):
+        await asyncio.gather(
+            *(self.summaries.set(self.backfill_key(video_id), summary) for video_id, summary in results.items())
+        )
+        loop = asyncio.get_running_loop()
+        deliveries = []
+        for video in doc["videos"]:
+            video_id = video[0]
+            if video_id not in results or video_id in doc["posted"]:
+                continue
+            delivered = loop.create_future()
+
+            async def on_done(error, video_id=video_id, delivered=delivered):
+                try:
+                    if error is None:
+                        await self.io.run("mongo", self.backfills.posted, doc["_id"], video_id)
+                finally:
+                    # Resolved even if the write fails, so the batch still finishes
+                    delivered.set_result(error is None)
+
+            deliveries.append(delivered)
+            self.dispatcher.submit(
+                doc["update_channel"],
+                self.sender(doc["update_channel"], tuple(video[1:]), results[video_id]),
+                on_done,
+            )
+        posted = sum(await asyncio.gather(*deliveries))
+        state = DONE if batch["status"] == "completed" else FAILED
+        await self.io.run(
+            "mongo", self.backfills.finish, doc["_id"], state, len(results),
+            None if state == DONE else batch["status"],
+        )
+        print(
+            f"Backfill batch {doc['_id']} {batch['status']}: {len(results)} summaries, "
+            f"{posted} posted to server {doc['guild_id']}."
+        )
+
+    @app_commands.describe(
+        url="URL of the YouTube channel",
+        videos=f"How many of its latest videos to summarize (up to {MAX_VIDEOS})",
+    )
+    async def backfill(self, interaction: discord.Interaction, url: str, videos: int = 20):
+        await interaction.response.defer(ephemeral=True)
+        server = self.configs.get(interaction.guild.id)
+        if not server:
+            await interaction.followup.send(
+                "Fatal error: server entry does not exist. Please contact the bot owner.", ephemeral=True
+            )
+            return
+        openai_key = server.get('openai_key')
+        update_channel = server.get('update_channel')
+        if not openai_key or openai_key == "None":
+            await interaction.followup.send(
+                "OpenAI key not configured. Please contact the server administrator.", ephemeral=True
+            )
+            return
+        if not update_channel or update_channel == "None":
+            await interaction.followup.send(
+                "No channel configured for summaries, please run /config first.", ephemeral=True
+            )
+            return
+        identifier = parse_channel_url(url)
+        channel_id = None
+        if identifier:
+            resolved, errors = await self.resolver.resolve_many([identifier])
+            if isinstance(errors.get(identifier), QuotaExhausted):
+                await interaction.followup.send(QUOTA_MESSAGE, ephemeral=True)
+                return
+            channel_id = resolved.get(identifier)
+        if not channel_id:
+            await interaction.followup.send("Invalid URL or channel not found.", ephemeral=True)
+            return
+        try:
+            queued, cached = await self.start_backfill(
+                interaction.guild.id, update_channel, openai_key, channel_id,
+                max(1, min(videos, MAX_VIDEOS)),
+            )
+        except QuotaExhausted:
+            await interaction.followup.send(QUOTA_MESSAGE, ephemeral=True)
+            return
+        except Exception as e:
+            print(f"Could not start a backfill for channel {channel_id}: {e}")
+            await interaction.followup.send(
+                "Could not start the backfill, please try again later.", ephemeral=True
+            )
+            return
+        message = f"Posting {cached} summaries that were already done."
+        if queued:
+            message += (
+                f" {queued} more videos were sent for summarizing in one batch and will be"
+                " posted when it finishes, within 24 hours."
+            )
+        await interaction.followup.send(message, ephemeral=True)
 
     @app_commands.describe(url="URL of the YouTube video")
     async def summary(self, interaction: discord.Interaction, url: str):
-        openai_key = self.mongo.get_openai_key(interaction.guild.id)
+        await interaction.response.defer()
+        openai_key = self.configs.get_openai_key(interaction.guild.id)
         if (not openai_key) or openai_key == "None":
             await interaction.followup.send(
                 "OpenAI key not configured. Please contact the server administrator.", ephemeral=False
             )
             return
-        await interaction.response.defer()
         video_id = extract_video_id_from_url(url)
         if not video_id:
             await interaction.followup.send(
                 "Invalid YouTube video URL.", ephemeral=True
             )
             return
-        transcript_text = self.fetch_transcript(video_id)
-        if transcript_text:
-            summary_text = summarize(transcript_text, self.mongo.get_openai_key(interaction.guild.id))
-
-            # Fetch additional details like title, channel name, etc.
-            video_details = self.get_video_details(video_id)
-            if video_details:
-                (
-                    video_title,
-                    channel_title,
-                    thumbnail_url,
-                    video_url,
-                    publish_date,
-                ) = video_details
-
-                embed = discord.Embed(
-                    title=f"Summary: {video_title}",
-                    url=video_url,
-                    description=summary_text,
-                    color=EMBED_COLOR,
+
+        # Fetch additional details like title, channel name, etc.
+        video_details = await self.videos.get(video_id)
+        if not video_details:
+            await interaction.followup.send(
+                "Could not fetch video details."
+            )
+            return
+        (
+            video_title,
+            channel_title,
+            thumbnail_url,
+            video_url,
+            publish_date,
+        ) = video_details
+
+        embed = discord.Embed(
+            title=f"Summary: {video_title}",
+            url=video_url,
+            color=EMBED_COLOR,
+        )
+        embed.set_author(name=channel_title)
+        embed.set_thumbnail(url=thumbnail_url)
+        embed.add_field(name="Published Date", value=publish_date, inline=False)
+        message = None
+
+        async def show(text):
+            # First call sends the follow-up, later calls edit it in place
+            nonlocal message
+            embed.description = text[:EMBED_DESCRIPTION_LIMIT]
+            if message is None:
+                message = await self.io.timed(
+                    "discord", interaction.followup.send(embed=embed, wait=True)
                 )
-                embed.set_author(name=channel_title)
-                embed.set_thumbnail(url=thumbnail_url)
-                embed.add_field(name="Published Date", value=publish_date, inline=False)
-                await interaction.followup.send(embed=embed)
             else:
-                await interaction.followup.send(
-                    "Could not fetch video details."
-                )
+                await self.io.timed("discord", message.edit(embed=embed))
+
+        async def compute():
+            transcript_text = await self.io.run(
+                "transcript", self.fetch_transcript, video_id, self.transcript_length()
+            )
+            if not transcript_text:
+                return None
+            content = await self.io.run("openai", self.summary_input, transcript_text, openai_key)
+            return await self.stream_summary(content, openai_key, show)
+
+        try:
+            summary_text = await self.summaries.get_or_create(self.summary_key(video_id), compute)
+        except Exception as e:
+            print(f"Could not summarize video ID {video_id}: {e}")
+            await interaction.followup.send("The summary request failed, please try again later.")
+            return
+        if summary_text:
+            await show(summary_text)
         else:
             await interaction.followup.send(
                 "Could not fetch or summarize the video transcript."
             )
 
+    async def stream_summary(self, content, openai_key, on_text):
+        # Runs the streaming completion on the I/O pool and calls on_text with
+        # the text so far, at most once every stream_edit_interval seconds
+        loop = asyncio.get_running_loop()
+        deltas = asyncio.Queue()
+
+        def produce():
+            try:
+                for delta in summarize_stream(content, openai_key):
+                    loop.call_soon_threadsafe(deltas.put_nowait, delta)
+            finally:
+                loop.call_soon_threadsafe(deltas.put_nowait, None)
+
+        producer = asyncio.ensure_future(self.io.run("openai", produce))
+        parts = []
+        last_edit = 0.0
+        while True:
+            delta = await deltas.get()
+            if delta is None:
+                break
+            parts.append(delta)
+            if time.monotonic() - last_edit >= self.stream_edit_interval:
+                await on_text("".join(parts))
+                last_edit = time.monotonic()
+        await producer  # re-raises anything the stream failed with
+        return "".join(parts)
+
     def get_video_details(self, video_id):
-        request = self.youtube.videos().list(part="snippet", id=video_id)
-        response = request.execute()
-
-        if response["items"]:
-            item = response["items"][0]
-            snippet = item["snippet"]
-            video_title = snippet["title"]
-            channel_title = snippet["channelTitle"]
-            thumbnail_url = snippet["thumbnails"]["high"]["url"]
-            video_url = f"https://www.youtube.com/watch?v={video_id}"
-            publish_date = snippet["publishedAt"]
-            return video_title, channel_title, thumbnail_url, video_url, publish_date
-        else:
-            return None
+        return self.videos.fetch([video_id]).get(video_id)
 
     def fetch_transcript(
         self, video_id, max_length=4000
-    ):  # Adjust max_length as needed
-        transcript_text = ""
+    ):  # Adjust max_length as needed, None keeps the whole transcript
+        parts = []
+        length = 0
         try:
-            transcript = YouTubeTranscriptApi.get_transcript(video_id)
+            # Full segment lists are stored, so retries and repeat requests
+            # never download a transcript twice
+            transcript = self.transcripts.get(video_id, self.transcript_languages)
             for text in transcript:
                 if (
-                    len(transcript_text) + len(text["text"]) < max_length - 200
+                    max_length is not None
+                    and length + len(text["text"]) >= max_length - 200
                 ):  # 200 char buffer
-                    transcript_text += text["text"] + " "
-                else:
                     break  # Stop adding text if max_length is reached
+                parts.append(text["text"])
+                length += len(text["text"]) + 1
         except Exception as e:
             print(f"Could not get transcript for video ID {video_id}: {e}")
+        return " ".join(parts)
+
+    def transcript_length(self):
+        return None if self.full_transcripts else 4000
+
+    def summary_input(self, transcript_text, openai_key):
+        # Text for the final (streamable) summary pass
+        if self.full_transcripts:
+            return reduce_transcript(transcript_text, openai_key, cache=self.chunk_store)
         return transcript_text
 
+    def summarize_transcript(self, transcript_text, openai_key):
+        if self.full_transcripts:
+            return summarize_long(transcript_text, openai_key, cache=self.chunk_store)
+        return summarize(transcript_text, openai_key)
+
+    def summary_key(self, video_id):
+        # Full-transcript summaries are a different result from truncated ones
+        prompt = prefix + chunk_prefix if self.full_transcripts else prefix
+        return summary_key(video_id, MODEL, prompt)
+
     @app_commands.describe(url="URL of the YouTube channel")
     async def addchannel(self, interaction: discord.Interaction, url: str):
-        identifier = extract_channel_identifier_from_url(url)
-        channel_id = identifier
+        identifier = parse_channel_url(url)
+        channel_id = None
+
+        # Handles and names go through the shared resolver cache
+        if identifier:
+            resolved, errors = await self.resolver.resolve_many([identifier])
+            if isinstance(errors.get(identifier), QuotaExhausted):
+                await interaction.response.send_message(QUOTA_MESSAGE, ephemeral=True)
+                return
+            channel_id = resolved.get(identifier)
 
-        # If the identifier is not in the channel ID format, retrieve the channel ID
-        if identifier and not identifier.startswith("UC"):
-            channel_id = get_channel_id_from_name(self.youtube, identifier)
-        
         # Check if channel_id is valid
         if not channel_id:
             await interaction.response.send_message(
@@ -310,31 +865,21 @@ class Quicktube:
             return
         # Update the mongo server
         guild_id = interaction.guild.id
-        if not self.mongo.server_exists(guild_id):
+        if not self.configs.exists(guild_id):
             # Throw fatal error
             await interaction.response.send_message(
                 "Fatal error: server entry does not exist. Please contact the bot owner.", 
                 ephemeral=True
             )
         else:
-            print('a')
-            server = self.mongo.get_server(guild_id)
-            print('b')
-            if channel_id not in server['monitored_channels']:
-                server['monitored_channels'].append(channel_id)
-                print('c')
-                try:
-                    result = self.mongo.servers.replace_one({'_id': ObjectId(server['_id'])}, server)
-                    if result.matched_count == 0:
-                        print("No matching document found to replace.")
-                    elif result.modified_count == 0:
-                        print("Document found but not modified.")
-                except Exception as e:
-                    print(f"An error occurred: {e}")
-
-                print('d')
-                channel_name = get_channel_name(self.youtube, channel_id)
-                print('e')
+            added = False
+            try:
+                added = await self.io.run("mongo", self.configs.add_channel, guild_id, channel_id)
+            except Exception as e:
+                print(f"An error occurred: {e}")
+            if added:
+                self.subscriptions.subscribe(channel_id, guild_id)
+                channel_name = await self.io.run("youtube", self.channels.title, channel_id)
                 await interaction.response.send_message(
                     f"Channel **{channel_name}** added for monitoring.", ephemeral=True
                 )
@@ -354,21 +899,75 @@ class Quicktube:
         #         "Invalid URL or channel already monitored.", ephemeral=True
         #     )
 
+    @app_commands.describe(urls="YouTube channel URLs, @handles or channel IDs, separated by spaces or commas")
+    async def addchannels(self, interaction: discord.Interaction, urls: str):
+        await interaction.response.defer(ephemeral=True)
+        guild_id = interaction.guild.id
+        if not self.configs.exists(guild_id):
+            await interaction.followup.send(
+                "Fatal error: server entry does not exist. Please contact the bot owner.", ephemeral=True
+            )
+            return
+        identifiers = {}  # (kind, value) -> first URL given for it
+        not_found = []
+        for url in split_channel_urls(urls):
+            identifier = parse_channel_url(url)
+            if identifier:
+                identifiers.setdefault(identifier, url)
+            else:
+                not_found.append(url)
+        # Cached names cost nothing, the rest are looked up concurrently
+        resolved, errors = await self.resolver.resolve_many(list(identifiers))
+        not_checked = [identifiers[identifier] for identifier in errors]
+        channel_ids = {}
+        for identifier, channel_id in resolved.items():
+            if channel_id:
+                channel_ids.setdefault(channel_id, identifiers[identifier])
+            else:
+                not_found.append(identifiers[identifier])
+        # One channels.list per 50 IDs confirms they exist and fetches titles
+        try:
+            metadata = await self.io.run("youtube", self.channels.get_many, list(channel_ids))
+        except QuotaExhausted:
+            await interaction.followup.send(QUOTA_MESSAGE, ephemeral=True)
+            return
+        not_found += [url for channel_id, url in channel_ids.items() if channel_id not in metadata]
+        try:
+            added = await self.io.run("mongo", self.configs.add_channels, guild_id, list(metadata))
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            await interaction.followup.send("Could not save the channels, please try again.", ephemeral=True)
+            return
+        for channel_id in added:
+            self.subscriptions.subscribe(channel_id, guild_id)
+
+        lines = [f"Added {len(added)} channel(s) for monitoring."]
+        if added:
+            lines.append(", ".join(f"**{metadata[channel_id]['title']}**" for channel_id in added))
+        if len(metadata) > len(added):
+            lines.append(f"{len(metadata) - len(added)} already monitored.")
+        if not_found:
+            lines.append(f"Not found: {', '.join(not_found)}")
+        if not_checked:
+            lines.append(f"Not checked, try again later: {', '.join(not_checked)}")
+        message = "\n".join(lines)
+        if len(message) > 2000:
+            message = message[:1997] + "..."
+        await interaction.followup.send(message, ephemeral=True)
+
     @app_commands.describe()
     async def listchannels(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
         # Check if there are monitored channels for the guild
-        if not self.mongo.server_exists(interaction.guild.id):
+        if not self.configs.exists(interaction.guild.id):
             # Throw fatal error
             await interaction.followup.send(
                 "Fatal error: server entry does not exist. Please contact the bot owner.", ephemeral=True
             )
             return
         # Get the list of monitored channels
-        server = self.mongo.get_server(interaction.guild.id)
-        print(server)
+        server = self.configs.get(interaction.guild.id)
         monitored_channels = server['monitored_channels']
-        print(monitored_channels)
         # Check if there are monitored channels
         if not monitored_channels or len(monitored_channels) == 0:
             await interaction.followup.send(
@@ -379,9 +978,14 @@ class Quicktube:
         # Start creating the embed
         embed = discord.Embed(title="Monitored YouTube Channels", color=EMBED_COLOR)
         # embed.set_thumbnail(url="URL_TO_A_RELEVANT_IMAGE")  # Optional: Set a thumbnail image for the embed
+        # Look up every channel name in one batched request at most
+        try:
+            metadata = await self.io.run("youtube", self.channels.get_many, monitored_channels)
+        except QuotaExhausted:
+            metadata = {}
         # Iterate over monitored channels and add their information to the embed
         for index, channel_id in enumerate(monitored_channels):
-            channel_name = get_channel_name(self.youtube, channel_id)
+            channel_name = metadata[channel_id]["title"] if channel_id in metadata else "Unknown Channel"
             embed.add_field(
                 name=f"{index+1}. {channel_name}",
                 value=f"ID: `{channel_id}`",
@@ -397,15 +1001,16 @@ class Quicktube:
     ):
         guild_id = interaction.guild.id
         #Check to see if the server entry exists
-        if not self.mongo.server_exists(guild_id):
+        if not self.configs.exists(guild_id):
             # Throw fatal error
             await interaction.response.send_message(
                 "Fatal error: server entry does not exist. Please contact the bot owner.", 
                 ephemeral=True
             )
+            return
         if channel is None and openai_key is None:
             # Grab the current server config and send it
-            server = self.mongo.get_server(guild_id)
+            server = self.configs.get(guild_id)
             update_channel = server['update_channel']
             openai_key_set = server['openai_key'] is not None and server['openai_key'] != "None"
             embed = discord.Embed(title="Server Configuration", color=EMBED_COLOR)
@@ -432,10 +1037,9 @@ class Quicktube:
         if openai_key is not None:
             update_data['openai_key'] = openai_key
         # Assuming the server entry already exists
-        self.mongo.servers.update_one(
-            {'guild_id': guild_id},
-            {'$set': update_data}
-        )
+        await self.io.run("mongo", self.configs.update, guild_id, update_data)
+        if channel is not None:
+            self.subscriptions.set_update_channel(guild_id, channel.id)
         response_message = "Configuration updated."
         if channel:
             response_message += f" Summaries will be posted in {channel.mention}."
@@ -450,19 +1054,19 @@ class Quicktube:
     ):
         # Get server object
         guild_id = interaction.guild.id
-        if not self.mongo.server_exists(guild_id):
+        if not self.configs.exists(guild_id):
             # Throw fatal error
             await interaction.response.send_message(
                 "Fatal error: server entry does not exist. Please contact the bot owner.", 
                 ephemeral=True
             )
             return
-        server = self.mongo.get_server(guild_id)
+        server = self.configs.get(guild_id)
         if channel_identifier in server['monitored_channels']:
-            channel_name = get_channel_name(self.youtube, channel_identifier)
-            server['monitored_channels'].remove(channel_identifier)
+            channel_name = await self.io.run("youtube", self.channels.title, channel_identifier)
             # update the mongo db
-            self.mongo.servers.replace_one({'_id': ObjectId(server['_id'])}, server)
+            await self.io.run("mongo", self.configs.remove_channel, guild_id, channel_identifier)
+            self.subscriptions.unsubscribe(channel_identifier, guild_id)
         else:
             # Check if the identifier is a digit (index)
             if channel_identifier.isdigit():
@@ -471,28 +1075,29 @@ class Quicktube:
                 )  # Subtract one for zero-based indexing
                 if 0 <= index < len(server['monitored_channels']):
                     channel_id = server['monitored_channels'][index]
-                    channel_name = get_channel_name(self.youtube, channel_id)
-                    server['monitored_channels'].pop(index)
+                    channel_name = await self.io.run("youtube", self.channels.title, channel_id)
                     # sync with mongo
-                    self.mongo.servers.replace_one({'_id': ObjectId(server['_id'])}, server)
+                    await self.io.run("mongo", self.configs.remove_channel, guild_id, channel_id)
+                    self.subscriptions.unsubscribe(channel_id, guild_id)
                 else:
                     await interaction.response.send_message(
                         "Invalid index provided.", ephemeral=True
                     )
                     return
             else:
-                found = False
-                for channel_id in server['monitored_channels']:
-                    name = get_channel_name(self.youtube, channel_id)
-                    if channel_identifier == name:
-                        server['monitored_channels'].remove(channel_id)
-                        # sync with mongo
-                        self.mongo.servers.replace_one({'_id': ObjectId(server['_id'])}, server)
-                        channel_name = name
-                        found = True
-                        break
-
-                if not found:
+                try:
+                    channel_id = await self.io.run(
+                        "youtube", self.channels.find_by_title, channel_identifier, server['monitored_channels']
+                    )
+                except QuotaExhausted:
+                    await interaction.response.send_message(QUOTA_MESSAGE, ephemeral=True)
+                    return
+                if channel_id:
+                    channel_name = self.channels.title(channel_id)
+                    # sync with mongo
+                    await self.io.run("mongo", self.configs.remove_channel, guild_id, channel_id)
+                    self.subscriptions.unsubscribe(channel_id, guild_id)
+                else:
                     await interaction.response.send_message(
                         "Channel not found in the monitored list.", ephemeral=True
                     )
@@ -512,9 +1117,89 @@ def main():
     parser.add_argument(
         "--discord-token", required=True, type=str, help="Discord Bot Token"
     )
+    parser.add_argument(
+        "--full-transcripts",
+        action="store_true",
+        help="Summarize entire transcripts in chunks instead of only the first 4000 characters",
+    )
+    parser.add_argument(
+        "--youtube-quota", type=int, default=10000, help="Daily YouTube Data API quota in units"
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, default=9108,
+        help="Port for the local Prometheus /metrics endpoint, 0 to disable",
+    )
+    parser.add_argument(
+        "--worker-id", type=str, default=None, help="Lease owner name, defaults to host-pid"
+    )
+    parser.add_argument(
+        "--partitions", type=int, default=64,
+        help="Channel partitions shared out between workers, the same for every worker",
+    )
+    parser.add_argument(
+        "--shard-count", type=int, default=None, help="Total Discord shards across all workers"
+    )
+    parser.add_argument(
+        "--shard-ids", type=str, default=None,
+        help="Comma-separated Discord shards this worker runs, e.g. 0,1 (needs --shard-count)",
+    )
+    parser.add_argument(
+        "--transcript-dir", type=str, default="transcripts", help="Where transcripts are stored"
+    )
+    parser.add_argument(
+        "--transcript-cache-mb", type=int, default=512, help="Size cap for stored transcripts"
+    )
+    parser.add_argument(
+        "--transcript-languages", type=str, default="en",
+        help="Comma-separated transcript languages in order of preference",
+    )
+    parser.add_argument(
+        "--websub-callback", type=str, default=None,
+        help="Public URL the WebSub hub can reach this worker's --websub-port on; enables push",
+    )
+    parser.add_argument(
+        "--websub-port", type=int, default=8080, help="Local port for WebSub callbacks"
+    )
+    parser.add_argument(
+        "--websub-secret", type=str, default=None,
+        help="HMAC secret for pushed notifications, keep it the same across restarts",
+    )
+    parser.add_argument("--websub-hub", type=str, default=HUB_URL, help="WebSub hub to subscribe at")
+    parser.add_argument(
+        "--websub-poll-interval", type=int, default=6 * 60 * 60,
+        help="Fallback poll interval in seconds for channels with a live push subscription",
+    )
+    parser.add_argument(
+        "--discord-global-limit", type=int, default=50,
+        help="Discord requests per second for the whole bot, raise it if Discord raised yours",
+    )
     args = parser.parse_args()
+    shard_ids = None
+    if args.shard_ids:
+        if args.shard_count is None:
+            parser.error("--shard-ids needs --shard-count")
+        shard_ids = [int(shard_id) for shard_id in args.shard_ids.split(",")]
 
-    bot = Quicktube(args.api_key, args.discord_token)
+    bot = Quicktube(
+        args.api_key,
+        args.discord_token,
+        full_transcripts=args.full_transcripts,
+        youtube_quota=args.youtube_quota,
+        metrics_port=args.metrics_port,
+        worker_id=args.worker_id,
+        partitions=args.partitions,
+        shard_count=args.shard_count,
+        shard_ids=shard_ids,
+        transcript_dir=args.transcript_dir,
+        transcript_cache_mb=args.transcript_cache_mb,
+        transcript_languages=args.transcript_languages.split(","),
+        websub_callback=args.websub_callback,
+        websub_port=args.websub_port,
+        websub_secret=args.websub_secret,
+        websub_hub=args.websub_hub,
+        websub_poll_interval=args.websub_poll_interval,
+        discord_global_limit=args.discord_global_limit,
+    )
     asyncio.run(bot.start())
 
 
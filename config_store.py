@@ -0,0 +1,245 @@
+import copy
+import threading
+from pymongo.errors import PyMongoError
+
+SECRET_FIELDS = ('yt_api_key', 'discord_token')
+
+
+def subscription(server):
+    # The parts of a config the subscription index is built from
+    return (
+        tuple(server.get('monitored_channels') or ()),
+        server.get('update_channel'),
+        server.get('active', True),
+    )
+
+
+class GuildConfigStore:
+    # Every guild config held in memory, with writes going through to Mongo.
+    # Outside edits are picked up from a change stream, or on standalone servers
+    # (no change streams) by polling each document's version counter.
+    def __init__(self, mongo, poll_interval=30):
+        self.mongo = mongo
+        self.poll_interval = poll_interval
+        self.servers = {}
+        self.guild_ids = {}  # Mongo _id -> guild_id, for change stream deletes
+        # Bumped whenever a guild's subscriptions may have changed, so the
+        # poll loop only rebuilds its index when there is something new
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.watcher = None
+
+    def load(self):
+        servers = {}
+        guild_ids = {}
+        for server in self.mongo.servers.find({}, {field: 0 for field in SECRET_FIELDS}):
+            servers[server['guild_id']] = server
+            guild_ids[server['_id']] = server['guild_id']
+        with self.lock:
+            self.servers = servers
+            self.guild_ids = guild_ids
+            self.generation += 1
+
+    def exists(self, guild_id):
+        return guild_id in self.servers
+
+    def get(self, guild_id):
+        # Returns a copy so callers can't mutate the cached config by accident.
+        # Copies are taken under the lock, as writes land from other threads.
+        with self.lock:
+            server = self.servers.get(guild_id)
+            return copy.deepcopy(server) if server else None
+
+    def all(self, guild_ids=None):
+        with self.lock:
+            if guild_ids is None:
+                # Guilds the bot has left keep their document, marked inactive
+                return [
+                    copy.deepcopy(server) for server in self.servers.values()
+                    if server.get('active', True)
+                ]
+            return [copy.deepcopy(self.servers[g]) for g in guild_ids if g in self.servers]
+
+    def subscriptions(self, guild_ids=None):
+        # Just what SubscriptionIndex.rebuild reads, without deep copies
+        with self.lock:
+            if guild_ids is None:
+                servers = [server for server in self.servers.values() if server.get('active', True)]
+            else:
+                servers = [self.servers[g] for g in guild_ids if g in self.servers]
+            return [
+                {
+                    'guild_id': server['guild_id'],
+                    'update_channel': server.get('update_channel'),
+                    'monitored_channels': list(server.get('monitored_channels') or ()),
+                }
+                for server in servers
+            ]
+
+    def get_openai_key(self, guild_id):
+        server = self.servers.get(guild_id)
+        return server.get('openai_key') if server else None
+
+    def create(self, guild_id):
+        if not self.exists(guild_id):
+            if not self.mongo.server_exists(guild_id):
+                self.mongo.new_server(guild_id)
+            self.refresh(guild_id)
+
+    def set_active(self, guild_id, active):
+        with self.lock:
+            server = self.servers.get(guild_id)
+            if server is None or server.get('active', True) == active:
+                return
+        self.update(guild_id, {'active': active})
+
+    def update(self, guild_id, fields):
+        self.mongo.servers.update_one(
+            {'guild_id': guild_id}, {'$set': fields, '$inc': {'version': 1}}
+        )
+        self._apply(guild_id, lambda server: server.update(fields))
+
+    def add_channel(self, guild_id, channel_id):
+        return bool(self.add_channels(guild_id, [channel_id]))
+
+    def add_channels(self, guild_id, channel_ids):
+        # One write for any number of channels; returns the ones that were new
+        with self.lock:
+            server = self.servers.get(guild_id)
+            if server is None:
+                return []
+            added = [
+                channel_id for channel_id in dict.fromkeys(channel_ids)
+                if channel_id not in server['monitored_channels']
+            ]
+        if not added:
+            return []
+        self.mongo.servers.update_one(
+            {'guild_id': guild_id},
+            {'$addToSet': {'monitored_channels': {'$each': added}}, '$inc': {'version': 1}}
+        )
+        self._apply(guild_id, lambda server: server['monitored_channels'].extend(added))
+        return added
+
+    def remove_channel(self, guild_id, channel_id):
+        self.mongo.servers.update_one(
+            {'guild_id': guild_id},
+            {'$pull': {'monitored_channels': channel_id}, '$inc': {'version': 1}}
+        )
+
+        def apply(server):
+            if channel_id in server['monitored_channels']:
+                server['monitored_channels'].remove(channel_id)
+
+        self._apply(guild_id, apply)
+
+    def set_last_video_id(self, guild_id, channel_id, video_id):
+        self.mongo.set_last_video_id(guild_id, channel_id, video_id)
+        self._apply(guild_id, lambda server: self._set_last_video(server, channel_id, video_id))
+
+    def mark_seen(self, guild_ids, channel_id, video_id):
+        self.mongo.mark_seen(guild_ids, channel_id, video_id)
+        for guild_id in guild_ids:
+            self._apply(guild_id, lambda server: self._set_last_video(server, channel_id, video_id))
+
+    @staticmethod
+    def _set_last_video(server, channel_id, video_id):
+        if not isinstance(server.get('last_video_ids'), dict):
+            server['last_video_ids'] = {}
+        server['last_video_ids'][channel_id] = video_id
+
+    def refresh(self, guild_id):
+        server = self.mongo.servers.find_one(
+            {'guild_id': guild_id}, {field: 0 for field in SECRET_FIELDS}
+        )
+        with self.lock:
+            if server:
+                self._store(server)
+            elif self.servers.pop(guild_id, None) is not None:
+                self.generation += 1
+
+    def _store(self, server):
+        # Called with the lock held
+        previous = self.servers.get(server['guild_id'])
+        if previous is None or subscription(previous) != subscription(server):
+            self.generation += 1
+        self.servers[server['guild_id']] = server
+        self.guild_ids[server['_id']] = server['guild_id']
+
+    def _apply(self, guild_id, change):
+        # Mirrors a write we already sent to Mongo, keeping versions in step
+        with self.lock:
+            server = self.servers.get(guild_id)
+            if server is None:
+                return
+            before = subscription(server)
+            change(server)
+            server['version'] = server.get('version', 0) + 1
+            if subscription(server) != before:
+                self.generation += 1
+
+    def watch(self):
+        # Runs until stop() in its own thread
+        if self.watcher and self.watcher.is_alive():
+            return
+        self.watcher = threading.Thread(
+            target=self._watch, name="quicktube-config-watch", daemon=True
+        )
+        self.watcher.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _watch(self):
+        try:
+            with self.mongo.servers.watch(full_document='updateLookup') as stream:
+                print("Watching guild configs with a change stream.")
+                while not self.stopped.is_set():
+                    change = stream.try_next()
+                    if change is None:
+                        self.stopped.wait(1)
+                        continue
+                    self._on_change(change)
+        except PyMongoError as e:
+            # Standalone servers don't support change streams
+            print(f"Change stream unavailable ({e}), polling configs every {self.poll_interval}s.")
+            self._poll()
+
+    def _on_change(self, change):
+        if change['operationType'] == 'delete':
+            guild_id = self.guild_ids.pop(change['documentKey']['_id'], None)
+            with self.lock:
+                if self.servers.pop(guild_id, None) is not None:
+                    self.generation += 1
+            return
+        server = change.get('fullDocument')
+        if server is None:
+            return
+        for field in SECRET_FIELDS:
+            server.pop(field, None)
+        with self.lock:
+            self._store(server)
+
+    def _poll(self):
+        while not self.stopped.wait(self.poll_interval):
+            try:
+                self.check_versions()
+            except PyMongoError as e:
+                print(f"Error polling guild configs: {e}")
+
+    def check_versions(self):
+        # One light query for every version counter, full reads only for changed guilds
+        remote = {
+            server['guild_id']: server.get('version', 0)
+            for server in self.mongo.servers.find({}, {'guild_id': 1, 'version': 1})
+        }
+        with self.lock:
+            local = {guild_id: server.get('version', 0) for guild_id, server in self.servers.items()}
+        for guild_id, version in remote.items():
+            if local.get(guild_id) != version:
+                self.refresh(guild_id)
+        with self.lock:
+            for guild_id in set(self.servers) - set(remote):
+                self.servers.pop(guild_id, None)
+                self.generation += 1
@@ -0,0 +1,212 @@
+import threading
+import xml.etree.ElementTree as ET
+import requests
+from googleapiclient.errors import HttpError
+from io_pool import execute
+from metadata import ChannelMetadataCache
+from metrics import DETECTOR_REQUESTS
+from rate_limit import QuotaCounter, QuotaExhausted
+
+FEED_URL = "https://www.youtube.com/feeds/videos.xml"
+FEED_NS = {
+    "atom": "http://www.w3.org/2005/Atom",
+    "yt": "http://www.youtube.com/xml/schemas/2015",
+    "media": "http://search.yahoo.com/mrss/",
+}
+NO_VIDEO = (None, None, None, None, None, None)
+
+
+class UploadDetector:
+    # Finds a channel's latest upload as cheaply as possible:
+    # public Atom feed (free) -> uploads playlist (1 unit) -> search (100 units)
+    # Feed and playlist requests are conditional on the last response's ETag,
+    # so a quiet channel costs a bodiless 304 and the last result is reused.
+    def __init__(
+        self, youtube, quota=None, metadata=None, use_feed=True, timeout=10, feed_url=FEED_URL
+    ):
+        self.youtube = youtube
+        self.quota = quota or QuotaCounter()
+        self.metadata = metadata or ChannelMetadataCache(youtube, self.quota)
+        self.use_feed = use_feed
+        self.timeout = timeout
+        self.feed_url = feed_url
+        self.session = requests.Session()
+        self.validators = {}  # (source, channel_id) -> (etag, last_modified, result)
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.not_modified = {}
+
+    def get_latest_video(self, channel_id):
+        # Returns (video_id, video_title, channel_title, thumbnail_url, video_url, publish_date)
+        if self.use_feed:
+            try:
+                return self.latest_from_feed(channel_id)
+            except Exception as e:
+                print(f"Feed lookup failed for channel {channel_id}: {e}")
+        try:
+            return self.latest_from_playlist(channel_id)
+        except Exception as e:
+            print(f"Uploads playlist lookup failed for channel {channel_id}: {e}")
+        try:
+            return self.latest_from_search(channel_id)
+        except QuotaExhausted as e:
+            print(e)
+            return NO_VIDEO
+
+    def uploads_playlist(self, channel_id):
+        # The uploads playlist never changes, so it comes from the metadata cache
+        metadata = self.metadata.get(channel_id, purpose="poll")
+        return metadata["uploads"] if metadata else None
+
+    def record(self, source, not_modified):
+        with self.lock:
+            self.requests[source] = self.requests.get(source, 0) + 1
+            if not_modified:
+                self.not_modified[source] = self.not_modified.get(source, 0) + 1
+        DETECTOR_REQUESTS.inc(source=source, result="not_modified" if not_modified else "modified")
+
+    def conditional_headers(self, source, channel_id):
+        etag, last_modified, _ = self.validators.get((source, channel_id), (None, None, None))
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def cached(self, source, channel_id):
+        return self.validators[(source, channel_id)][2]
+
+    def remember(self, source, channel_id, etag, last_modified, result):
+        if etag or last_modified:
+            self.validators[(source, channel_id)] = (etag, last_modified, result)
+
+    def forget(self, channel_ids):
+        # Drops validators for channels nobody follows any more
+        channel_ids = set(channel_ids)
+        for key in [key for key in self.validators if key[1] not in channel_ids]:
+            self.validators.pop(key, None)
+
+    def latest_from_feed(self, channel_id):
+        response = self.session.get(
+            self.feed_url,
+            params={"channel_id": channel_id},
+            headers=self.conditional_headers("feed", channel_id),
+            timeout=self.timeout,
+        )
+        if response.status_code == 304 and ("feed", channel_id) in self.validators:
+            self.record("feed", True)
+            return self.cached("feed", channel_id)
+        response.raise_for_status()
+        self.record("feed", False)
+        result = self.parse_feed(response.content)
+        self.remember(
+            "feed", channel_id,
+            response.headers.get("ETag"), response.headers.get("Last-Modified"), result,
+        )
+        return result
+
+    def parse_feed(self, content):
+        root = ET.fromstring(content)
+        entry = root.find("atom:entry", FEED_NS)
+        if entry is None:
+            return NO_VIDEO
+        video_id = entry.findtext("yt:videoId", namespaces=FEED_NS)
+        thumbnail = entry.find("media:group/media:thumbnail", FEED_NS)
+        return (
+            video_id,
+            entry.findtext("atom:title", namespaces=FEED_NS),
+            entry.findtext("atom:author/atom:name", namespaces=FEED_NS),
+            thumbnail.get("url") if thumbnail is not None else None,
+            f"https://www.youtube.com/watch?v={video_id}",
+            entry.findtext("atom:published", namespaces=FEED_NS),
+        )
+
+    def latest_from_playlist(self, channel_id):
+        playlist_id = self.uploads_playlist(channel_id)
+        if not playlist_id:
+            return NO_VIDEO
+        self.quota.charge("playlistItems.list", "poll")
+        request = self.youtube.playlistItems().list(
+            part="snippet,contentDetails", playlistId=playlist_id, maxResults=1
+        )
+        request.headers.update(self.conditional_headers("playlist", channel_id))
+        try:
+            response = execute(request)
+        except HttpError as e:
+            # googleapiclient raises on 304 before reading any JSON
+            if e.resp.status == 304 and ("playlist", channel_id) in self.validators:
+                self.record("playlist", True)
+                return self.cached("playlist", channel_id)
+            raise
+        self.record("playlist", False)
+        if not response.get("items"):
+            result = NO_VIDEO
+        else:
+            item = response["items"][0]
+            snippet = item["snippet"]
+            video_id = item["contentDetails"]["videoId"]
+            result = (
+                video_id,
+                snippet["title"],
+                snippet["channelTitle"],
+                snippet["thumbnails"]["high"]["url"],
+                f"https://www.youtube.com/watch?v={video_id}",
+                item["contentDetails"].get("videoPublishedAt", snippet["publishedAt"]),
+            )
+        self.remember("playlist", channel_id, response.get("etag"), None, result)
+        return result
+
+    def recent_uploads(self, channel_id, count):
+        # Up to `count` uploads, newest first, from the uploads playlist (1 unit per 50)
+        playlist_id = self.uploads_playlist(channel_id)
+        videos = []
+        page_token = None
+        while playlist_id and len(videos) < count:
+            self.quota.charge("playlistItems.list")
+            response = execute(self.youtube.playlistItems().list(
+                part="snippet,contentDetails", playlistId=playlist_id,
+                maxResults=min(50, count - len(videos)), pageToken=page_token,
+            ))
+            for item in response.get("items", []):
+                snippet = item["snippet"]
+                video_id = item["contentDetails"]["videoId"]
+                videos.append((
+                    video_id,
+                    snippet["title"],
+                    snippet["channelTitle"],
+                    snippet["thumbnails"]["high"]["url"],
+                    f"https://www.youtube.com/watch?v={video_id}",
+                    item["contentDetails"].get("videoPublishedAt", snippet["publishedAt"]),
+                ))
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                break
+        return videos[:count]
+
+    def latest_from_search(self, channel_id):
+        self.quota.charge("search.list", "poll")
+        response = execute(self.youtube.search().list(
+            part="snippet", channelId=channel_id, maxResults=1, order="date"
+        ))
+        if not response["items"]:
+            return NO_VIDEO
+        item = response["items"][0]
+        video_id = item["id"]["videoId"]
+        snippet = item["snippet"]
+        return (
+            video_id,
+            snippet["title"],
+            snippet["channelTitle"],
+            snippet["thumbnails"]["high"]["url"],
+            f"https://www.youtube.com/watch?v={video_id}",
+            snippet["publishedAt"],
+        )
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": dict(self.requests),
+                "not_modified": dict(self.not_modified),
+                "validators": len(self.validators),
+            }
@@ -0,0 +1,174 @@
+import asyncio
+import time
+from collections import deque
+
+import aiohttp
+import discord
+
+from metrics import DISCORD_DELIVERIES, DISCORD_DELIVERY_SECONDS
+
+WINDOW_SLACK = 0.05  # Discord's window starts when our request lands, a little later
+
+
+class RateBucket:
+    # At most `limit` requests per `per`-second window, the way Discord's own
+    # buckets count them
+    def __init__(self, limit, per):
+        self.limit = limit
+        self.per = per
+        self.remaining = limit
+        self.reset_at = 0.0
+
+    def take(self):
+        # Spends one request and returns 0, or returns how long until the next window
+        now = time.monotonic()
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now + self.per + WINDOW_SLACK
+        if self.remaining > 0:
+            self.remaining -= 1
+            return 0.0
+        return self.reset_at - now
+
+    def pause(self, seconds):
+        # Nothing more for `seconds`, e.g. after Discord answered 429
+        self.remaining = 0
+        self.reset_at = max(self.reset_at, time.monotonic() + seconds)
+
+    async def wait(self):
+        delay = self.take()
+        while delay:
+            await asyncio.sleep(delay)
+            delay = self.take()
+
+
+class Delivery:
+    __slots__ = ("send", "on_done", "queued", "attempts")
+
+    def __init__(self, send, on_done):
+        self.send = send  # async callable making the request
+        self.on_done = on_done  # async (error), error is None once sent
+        self.queued = time.monotonic()
+        self.attempts = 0
+
+
+class FanoutDispatcher:
+    # Sends posts to many Discord channels at once. Every destination channel
+    # gets a lane that sends its posts in order inside the channel's bucket;
+    # a global bucket and a cap on requests in flight keep the whole bot under
+    # Discord's limits. A rate-limited or failing send waits and retries on
+    # its own lane, so it never holds up other channels.
+    def __init__(
+        self, global_limit=50, global_per=1.0, channel_limit=5, channel_per=5.0, concurrency=50,
+        max_attempts=5, retry_delay=1.0,
+    ):
+        self.global_limit = global_limit
+        self.global_bucket = RateBucket(global_limit, global_per)
+        self.channel_limit = channel_limit
+        self.channel_per = channel_per
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lanes = {}  # channel_id -> deque of deliveries
+        self.buckets = {}  # channel_id -> RateBucket, kept until its window ends
+        self.tasks = {}
+        self.inflight = None
+        self.idle = None
+        self.pending = 0
+        self.counts = {"sent": 0, "failed": 0, "retries": 0}
+        self.slowest = 0.0
+
+    def submit(self, channel_id, send, on_done=None):
+        if self.inflight is None:
+            self.inflight = asyncio.Semaphore(self.concurrency)
+            self.idle = asyncio.Event()
+        self.lanes.setdefault(channel_id, deque()).append(Delivery(send, on_done))
+        self.pending += 1
+        self.idle.clear()
+        if channel_id not in self.tasks:
+            if len(self.buckets) > len(self.tasks) + 1000:
+                self.prune()
+            self.tasks[channel_id] = asyncio.create_task(self._lane(channel_id))
+
+    def share(self, workers):
+        # Discord's global limit is per bot, so worker processes split it
+        self.global_bucket.limit = max(1, self.global_limit // workers)
+
+    def prune(self):
+        now = time.monotonic()
+        for channel_id, bucket in list(self.buckets.items()):
+            if bucket.reset_at <= now and channel_id not in self.tasks:
+                del self.buckets[channel_id]
+
+    async def join(self):
+        # Until everything submitted so far was sent or gave up
+        if self.pending:
+            await self.idle.wait()
+
+    async def _lane(self, channel_id):
+        lane = self.lanes[channel_id]
+        bucket = self.buckets.setdefault(
+            channel_id, RateBucket(self.channel_limit, self.channel_per)
+        )
+        try:
+            while lane:
+                delivery = lane[0]
+                await bucket.wait()
+                await self.global_bucket.wait()
+                delivery.attempts += 1
+                error = None
+                async with self.inflight:
+                    try:
+                        await delivery.send()
+                    except Exception as e:
+                        error = e
+                retry_after = self.retry_after(error, delivery.attempts)
+                if retry_after is not None:
+                    self.counts["retries"] += 1
+                    DISCORD_DELIVERIES.inc(result="retried")
+                    bucket.pause(retry_after)
+                    continue
+                lane.popleft()
+                await self.finish(delivery, error)
+        finally:
+            self.tasks.pop(channel_id, None)
+            if not lane:
+                self.lanes.pop(channel_id, None)
+
+    def retry_after(self, error, attempts):
+        # Seconds to wait before trying again, or None when it's final
+        if error is None or attempts >= self.max_attempts:
+            return None
+        backoff = self.retry_delay * 2 ** (attempts - 1)
+        if isinstance(error, discord.RateLimited):
+            return error.retry_after
+        if isinstance(error, discord.HTTPException):
+            # 403s and 404s won't get better
+            return backoff if error.status == 429 or error.status >= 500 else None
+        if isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError)):
+            return backoff
+        return None
+
+    async def finish(self, delivery, error):
+        if error is None:
+            seconds = time.monotonic() - delivery.queued
+            self.counts["sent"] += 1
+            self.slowest = max(self.slowest, seconds)
+            DISCORD_DELIVERIES.inc(result="sent")
+            DISCORD_DELIVERY_SECONDS.observe(seconds)
+        else:
+            self.counts["failed"] += 1
+            DISCORD_DELIVERIES.inc(result="failed")
+        if delivery.on_done:
+            try:
+                await delivery.on_done(error)
+            except Exception as e:
+                print(f"Error after delivering a post: {e}")
+        self.pending -= 1
+        if not self.pending:
+            self.idle.set()
+
+    def stats(self):
+        return dict(
+            self.counts, queued=self.pending, lanes=len(self.tasks), slowest_seconds=self.slowest
+        )
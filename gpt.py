@@ -1,4 +1,26 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
 import requests
+from requests.adapters import HTTPAdapter
+from metrics import OPENAI_RETRIES
+from rate_limit import KeyRateLimiter
+
+MODEL = "gpt-4"
+API_BASE = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1")
+TIMEOUT = (5, 120)  # (connect, read) seconds
+MAX_RETRIES = 4
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+CHUNK_TOKENS = 3000  # per-chunk budget, leaves room for the prompt and reply in gpt-4's context
+CHARS_PER_TOKEN = 4  # rough estimate for English text
+BATCH_WINDOW = "24h"  # the only completion window the Batch API offers
+BATCH_POLL_INTERVAL = 60  # seconds between status checks
+BATCH_OPEN = {"validating", "in_progress", "finalizing", "cancelling"}
 
 prefix = """Your output should use the following template:
 ## Summary
@@ -8,26 +30,281 @@ prefix = """Your output should use the following template:
 
 Your task is to summarise the text I have given you in up to seven concise bullet points, starting with a short overview of the content."""
 
-def summarize(content, key):
-    # Create the JSON payload
-    token = key
-    payload = {
-        "model": "gpt-4",
+chunk_prefix = """The text I have given you is one part of a longer video transcript.
+Summarise this part in a few concise bullet points, keeping names, numbers and conclusions."""
+
+merge_intro = "The following are summaries of consecutive parts of a single video, in order:\n\n"
+
+_chunk_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="quicktube-chunks")
+
+
+class OpenAIClient:
+    # Keep-alive connection pool shared by every summarize call, with timeouts
+    # and jittered exponential backoff that honours Retry-After
+    def __init__(
+        self, base_url=API_BASE, timeout=TIMEOUT, max_retries=MAX_RETRIES, pool_size=16,
+        limiter=None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.limiter = limiter or KeyRateLimiter()
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.latency = 0.0
+
+    def post(self, path, key, payload, idempotent=True):
+        return self.send(path, key, payload, idempotent=idempotent).json()
+
+    def get(self, path, key):
+        # The raw response, since file contents aren't JSON
+        return self.send(path, key, method="GET")
+
+    def upload(self, path, key, filename, data, purpose):
+        # Multipart file upload, e.g. a batch's JSONL input
+        return self.send(
+            path, key, {"purpose": purpose}, files={"file": (filename, data)}, idempotent=False
+        ).json()
+
+    def stream(self, path, key, payload):
+        # Yields each server-sent event's JSON data until [DONE]
+        response = self.send(path, key, dict(payload, stream=True), stream=True)
+        with response:
+            # chunk_size=None hands over data as soon as it arrives
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    return
+                yield json.loads(data)
+
+    def send(
+        self, path, key, payload=None, stream=False, method="POST", files=None, idempotent=True
+    ):
+        # Retries cover everything up to the response headers; a stream that
+        # breaks part-way through is left to the caller. Requests that create
+        # something (idempotent=False) are only retried when the server can't
+        # have acted on them: a 429, or a connection that never opened.
+        headers = {"Authorization": f"Bearer {key}"}
+        if files:
+            body = {"data": payload, "files": files}
+        else:
+            headers["Content-Type"] = "application/json"
+            body = {"json": payload}
+        url = f"{self.base_url}{path}"
+        attempt = 0
+        while True:
+            # Every guild brings its own key, each with its own request budget
+            self.limiter.acquire(key)
+            start = time.perf_counter()
+            response = None
+            try:
+                response = self.session.request(
+                    method, url, headers=headers, timeout=self.timeout, stream=stream, **body
+                )
+                retry = response.status_code in RETRY_STATUSES
+                if retry and not idempotent:
+                    retry = response.status_code == 429
+                if not retry:
+                    response.raise_for_status()
+                    return response
+                error = requests.HTTPError(f"{response.status_code} from {url}", response=response)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+                retry = idempotent or isinstance(e, requests.ConnectTimeout)
+            finally:
+                self.record(time.perf_counter() - start)
+            if not retry or attempt >= self.max_retries:
+                with self.lock:
+                    self.failures += 1
+                raise error
+            delay = self.retry_delay(attempt, response)
+            print(f"OpenAI request failed ({error}), retrying in {delay:.1f}s")
+            with self.lock:
+                self.retries += 1
+            OPENAI_RETRIES.inc()
+            time.sleep(delay)
+            attempt += 1
+
+    def retry_delay(self, attempt, response):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                try:
+                    return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+                except (TypeError, ValueError):
+                    pass
+        return min(60.0, 2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def record(self, seconds):
+        with self.lock:
+            self.requests += 1
+            self.latency += seconds
+
+    def stats(self):
+        pools = self.adapter.poolmanager.pools
+        opened = sum(pools[key].num_connections for key in pools.keys())
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            "avg_latency": self.latency / self.requests if self.requests else 0.0,
+            # Anything below requests means connections were reused
+            "connections_opened": opened,
+            "rate_limit": self.limiter.stats(),
+        }
+
+
+client = OpenAIClient()
+
+
+def chat_payload(content, system_prompt=prefix):
+    return {
+        "model": MODEL,
         "messages": [
-            {"role": "system", "content": prefix},
+            {"role": "system", "content": system_prompt},
             {"role": "user", "content": content},
         ],
         "temperature": 0.0,
     }
 
+
+def summarize(content, key, system_prompt=prefix):
     # Make the API request
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {token}"}
-    response = requests.post(
-        "https://api.openai.com/v1/chat/completions", headers=headers, json=payload
-    )
-    response.raise_for_status()
+    data = client.post("/chat/completions", key, chat_payload(content, system_prompt))
 
     # Parse the response
-    data = response.json()
     result = data["choices"][0]["message"]["content"]
     return result
+
+
+def summarize_stream(content, key, system_prompt=prefix):
+    # Same request as summarize, but yields the reply text as it arrives
+    for event in client.stream("/chat/completions", key, chat_payload(content, system_prompt)):
+        if not event.get("choices"):
+            continue
+        delta = event["choices"][0].get("delta", {}).get("content")
+        if delta:
+            yield delta
+
+
+def submit_batch(contents, key, system_prompt=prefix):
+    # contents is {custom_id: text}. Everything goes up as one JSONL file and
+    # one batch: half the price of live requests, and only two calls against
+    # the key's rate limit however many videos there are.
+    lines = [
+        json.dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": chat_payload(content, system_prompt),
+        })
+        for custom_id, content in contents.items()
+    ]
+    data = ("\n".join(lines) + "\n").encode("utf-8")
+    upload = client.upload("/files", key, "summaries.jsonl", data, purpose="batch")
+    # Not retried once sent: a batch the server took despite a timeout would
+    # otherwise run, and be billed, twice
+    return client.post("/batches", key, {
+        "input_file_id": upload["id"],
+        "endpoint": "/v1/chat/completions",
+        "completion_window": BATCH_WINDOW,
+    }, idempotent=False)
+
+
+def get_batch(batch_id, key):
+    return client.get(f"/batches/{batch_id}", key).json()
+
+
+def batch_results(batch, key):
+    # {custom_id: summary} for every request in a finished batch that succeeded.
+    # Expired and cancelled batches still return whatever did finish.
+    if not batch.get("output_file_id"):
+        return {}
+    results = {}
+    content = client.get(f"/files/{batch['output_file_id']}/content", key).text
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        response = result.get("response") or {}
+        if result.get("error") or response.get("status_code") != 200:
+            print(f"Batch request {result.get('custom_id')} failed: {result.get('error') or response}")
+            continue
+        results[result["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+    return results
+
+
+def summarize_batch(contents, key, poll_interval=BATCH_POLL_INTERVAL):
+    # Blocking version for scripts: submits, waits for the batch, returns results
+    batch = submit_batch(contents, key)
+    while batch["status"] in BATCH_OPEN:
+        time.sleep(poll_interval)
+        batch = get_batch(batch["id"], key)
+    if batch["status"] != "completed":
+        print(f"Batch {batch['id']} ended as {batch['status']}")
+    return batch_results(batch, key)
+
+
+def chunk_text(content, max_tokens=CHUNK_TOKENS):
+    # Splits on word boundaries so each chunk stays under the token budget
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    chunks = []
+    current = []
+    length = 0
+    for word in content.split():
+        if current and length + len(word) + 1 > max_chars:
+            chunks.append(" ".join(current))
+            current = []
+            length = 0
+        current.append(word)
+        length += len(word) + 1
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def chunk_key(chunk):
+    return hashlib.sha256(f"{MODEL}\n{chunk_prefix}\n{chunk}".encode("utf-8")).hexdigest()
+
+
+def summarize_long(content, key, cache=None, max_tokens=CHUNK_TOKENS):
+    # Map-reduce over the whole transcript: summarise chunks concurrently, then
+    # merge the partial summaries with the normal prefix template. Chunk results
+    # are stored in cache (get/set by key) so a retry only redoes failed chunks.
+    return summarize(reduce_transcript(content, key, cache, max_tokens), key)
+
+
+def reduce_transcript(content, key, cache=None, max_tokens=CHUNK_TOKENS):
+    # The map step of summarize_long: returns the text for the final summary
+    # pass, which is the content itself when it already fits in one chunk
+    chunks = chunk_text(content, max_tokens)
+    if len(chunks) <= 1:
+        return content
+    cache = cache if cache is not None else {}
+
+    def summarize_chunk(chunk):
+        ck = chunk_key(chunk)
+        partial = cache.get(ck)
+        if partial is None:
+            partial = summarize(chunk, key, system_prompt=chunk_prefix)
+            cache[ck] = partial
+        return partial
+
+    partials = list(_chunk_executor.map(summarize_chunk, chunks))
+    merged = "\n\n".join(
+        f"Part {index + 1}:\n{partial}" for index, partial in enumerate(partials)
+    )
+    if len(merged) > max_tokens * CHARS_PER_TOKEN:
+        # Very long videos: reduce the partial summaries again before merging
+        return reduce_transcript(merged, key, cache, max_tokens)
+    return merge_intro + merged
@@ -0,0 +1,95 @@
+import asyncio
+import functools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import IO_ERRORS, IO_SECONDS
+
+_local = threading.local()
+
+# Kinds that can hold a thread for seconds to minutes (streamed completions,
+# rate limit and backoff sleeps, chunked summaries, transcript downloads) get
+# pools of their own, so quick Mongo and YouTube calls never queue behind them
+SLOW_KINDS = {"openai": 16, "transcript": 8}
+
+
+def execute(request):
+    # httplib2 isn't thread-safe, so every pool thread executes
+    # googleapiclient requests over its own connection
+    http = getattr(_local, "http", None)
+    if http is None:
+        import httplib2  # already loaded by googleapiclient by the time requests run
+
+        http = _local.http = httplib2.Http(timeout=30)
+    return request.execute(http=http)
+
+
+class IOPool:
+    # Bounded thread pools that keep blocking YouTube, transcript, OpenAI
+    # and Mongo calls off the Discord event loop, timing every call by kind
+    def __init__(self, max_workers=16, window=500, slow_kinds=SLOW_KINDS):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="quicktube-io"
+        )
+        self.executors = {
+            kind: ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"quicktube-{kind}")
+            for kind, workers in slow_kinds.items()
+        }
+        self.window = window
+        self.latencies = {}
+        self.errors = {}
+
+    async def run(self, kind, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(
+                self.executors.get(kind, self.executor), functools.partial(func, *args, **kwargs)
+            )
+        except Exception:
+            self.error(kind)
+            raise
+        finally:
+            self.record(kind, time.perf_counter() - start)
+
+    async def timed(self, kind, awaitable):
+        # Times calls that are already async, like Discord sends
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        except Exception:
+            self.error(kind)
+            raise
+        finally:
+            self.record(kind, time.perf_counter() - start)
+
+    def record(self, kind, seconds):
+        if kind not in self.latencies:
+            self.latencies[kind] = deque(maxlen=self.window)
+        self.latencies[kind].append(seconds)
+        IO_SECONDS.observe(seconds, kind=kind)
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+        IO_ERRORS.inc(kind=kind)
+
+    def stats(self):
+        # Returns {kind: {count, errors, avg, p95, max}} over the recent window
+        result = {}
+        for kind, samples in self.latencies.items():
+            ordered = sorted(samples)
+            result[kind] = {
+                "count": len(ordered),
+                "errors": self.errors.get(kind, 0),
+                "avg": sum(ordered) / len(ordered),
+                "p95": ordered[int(0.95 * (len(ordered) - 1))],
+                "max": ordered[-1],
+            }
+        return result
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for executor in self.executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
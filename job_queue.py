@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta, timezone
+from pymongo import ReturnDocument
+
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+DONE = "done"
+FAILED = "failed"
+
+JOB_TTL = 7 * 24 * 60 * 60  # finished jobs are kept a week
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+class SummaryJobQueue:
+    # One job per video in Mongo, holding the guilds it should be posted to.
+    # Workers claim jobs atomically with a lease; a job whose worker died goes
+    # back to the queue when the lease runs out. Summaries themselves live in
+    # the summary cache, so a retried job doesn't pay for GPT calls again.
+    def __init__(self, collection, lease_seconds=600, max_attempts=3, retry_delay=300):
+        self.collection = collection
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    def setup(self):
+        self.collection.create_index([('state', 1), ('available_at', 1)])
+        self.collection.create_index('finished_at', expireAfterSeconds=JOB_TTL)
+
+    def enqueue(self, video_id, channel_id, video, targets):
+        # targets are [guild_id, update_channel] pairs; adding guilds to a
+        # finished job puts it back in the queue for them. Returns whether the
+        # job is newly pending, i.e. worth trying to claim straight away.
+        now = utcnow()
+        result = self.collection.update_one(
+            {'_id': video_id},
+            {
+                '$setOnInsert': {
+                    'channel_id': channel_id,
+                    'video': list(video),
+                    'state': PENDING,
+                    'attempts': 0,
+                    'available_at': now,
+                    'created_at': now,
+                },
+                '$addToSet': {'targets': {'$each': [list(target) for target in targets]}},
+            },
+            upsert=True,
+        )
+        if result.upserted_id is not None:
+            return True
+        if not result.modified_count:
+            return False
+        reset = self.collection.update_one(
+            {'_id': video_id, 'state': {'$in': [DONE, FAILED]}},
+            {'$set': {'state': PENDING, 'attempts': 0, 'available_at': now},
+             '$unset': {'finished_at': ""}},
+        )
+        return reset.modified_count == 1
+
+    def claim(self, owner, video_id=None):
+        # Atomically takes a pending job, or one whose lease ran out
+        now = utcnow()
+        query = {
+            'attempts': {'$lt': self.max_attempts},
+            '$or': [
+                {'state': PENDING, 'available_at': {'$lte': now}},
+                {'state': IN_PROGRESS, 'lease_expires': {'$lt': now}},
+            ],
+        }
+        if video_id is not None:
+            query['_id'] = video_id
+        return self.collection.find_one_and_update(
+            query,
+            {
+                '$set': {
+                    'state': IN_PROGRESS,
+                    'owner': owner,
+                    'lease_expires': now + timedelta(seconds=self.lease_seconds),
+                },
+                '$inc': {'attempts': 1},
+            },
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def claim_post(self, video_id, guild_id):
+        # Records the delivery to one guild before it's sent; False if the
+        # video already went there, on this attempt or an earlier one
+        result = self.collection.update_one(
+            {'_id': video_id, 'posted': {'$ne': guild_id}},
+            {'$addToSet': {'posted': guild_id}},
+        )
+        return result.modified_count == 1
+
+    def release_post(self, video_id, guild_id):
+        # The send gave up, so the job's retry may try this guild again
+        self.collection.update_one({'_id': video_id}, {'$pull': {'posted': guild_id}})
+
+    def complete(self, video_id, owner):
+        self.collection.update_one(
+            {'_id': video_id, 'owner': owner, 'state': IN_PROGRESS},
+            {'$set': {'state': DONE, 'finished_at': utcnow()}},
+        )
+
+    def fail(self, video_id, owner, error):
+        # Back to the queue after a delay, or failed for good after max_attempts
+        job = self.collection.find_one({'_id': video_id, 'owner': owner, 'state': IN_PROGRESS})
+        if job is None:
+            return
+        now = utcnow()
+        if job['attempts'] >= self.max_attempts:
+            update = {'state': FAILED, 'error': error, 'finished_at': now}
+        else:
+            delay = self.retry_delay * job['attempts']
+            update = {'state': PENDING, 'error': error, 'available_at': now + timedelta(seconds=delay)}
+        self.collection.update_one({'_id': video_id, 'owner': owner}, {'$set': update})
+
+    def expire(self):
+        # Jobs that ran out of leases and attempts
+        self.collection.update_many(
+            {
+                'state': IN_PROGRESS,
+                'lease_expires': {'$lt': utcnow()},
+                'attempts': {'$gte': self.max_attempts},
+            },
+            {'$set': {'state': FAILED, 'error': "lease expired", 'finished_at': utcnow()}},
+        )
+
+    def recover(self, owner):
+        # On startup, jobs this worker held before a restart go straight back
+        self.collection.update_many(
+            {'state': IN_PROGRESS, 'owner': owner},
+            {'$set': {'state': PENDING, 'available_at': utcnow()}},
+        )
+
+    def counts(self):
+        counts = {PENDING: 0, IN_PROGRESS: 0, DONE: 0, FAILED: 0}
+        for row in self.collection.aggregate([{'$group': {'_id': '$state', 'count': {'$sum': 1}}}]):
+            counts[row['_id']] = row['count']
+        return counts
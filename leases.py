@@ -0,0 +1,119 @@
+import math
+import os
+import socket
+import threading
+import zlib
+from datetime import datetime, timedelta, timezone
+from pymongo.errors import BulkWriteError, PyMongoError
+
+
+def partition(channel_id, partitions):
+    # Stable across processes and hosts, unlike hash()
+    return zlib.crc32(channel_id.encode("utf-8")) % partitions
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class PartitionLeases:
+    # YouTube channels are split into a fixed number of partitions, each leased
+    # to one poller worker through a document in Mongo. Every heartbeat a worker
+    # renews its leases and evens out to partitions / live workers, handing back
+    # extras and taking over free or expired ones. All workers must agree on
+    # the partition count.
+    def __init__(self, mongo, worker_id=None, partitions=64, lease_seconds=60, heartbeat=15):
+        self.leases = mongo.leases
+        self.workers = mongo.workers
+        self.worker_id = worker_id or default_worker_id()
+        self.partitions = partitions
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = heartbeat
+        self.owned = frozenset()
+        self.live_workers = 1
+        self.takeovers = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def setup(self):
+        try:
+            self.leases.insert_many(
+                [{'_id': p, 'owner': None, 'expires_at': None} for p in range(self.partitions)],
+                ordered=False,
+            )
+        except BulkWriteError:
+            pass  # another worker created them first
+        # Dead workers drop out of the live count on their own
+        self.workers.create_index('expires_at', expireAfterSeconds=0)
+
+    def owns(self, channel_id):
+        return partition(channel_id, self.partitions) in self.owned
+
+    def heartbeat(self):
+        now = datetime.now(timezone.utc)
+        expires = now + timedelta(seconds=self.lease_seconds)
+        self.workers.replace_one(
+            {'_id': self.worker_id}, {'_id': self.worker_id, 'expires_at': expires}, upsert=True
+        )
+        # Leases taken over while we weren't looking simply stop matching
+        self.leases.update_many({'owner': self.worker_id}, {'$set': {'expires_at': expires}})
+        owned = {lease['_id'] for lease in self.leases.find({'owner': self.worker_id}, {'_id': 1})}
+        live = max(1, self.workers.count_documents({'expires_at': {'$gt': now}}))
+        self.live_workers = live
+        share = math.ceil(self.partitions / live)
+        for p in sorted(owned)[share:]:
+            self.leases.update_one(
+                {'_id': p, 'owner': self.worker_id}, {'$set': {'owner': None, 'expires_at': None}}
+            )
+            owned.discard(p)
+        if len(owned) < share:
+            available = {'$or': [{'owner': None}, {'expires_at': {'$lt': now}}]}
+            for lease in list(self.leases.find(available, {'_id': 1})):
+                if len(owned) >= share:
+                    break
+                # Atomic, so only one worker wins each free partition
+                previous = self.leases.find_one_and_update(
+                    dict(available, _id=lease['_id']),
+                    {'$set': {'owner': self.worker_id, 'expires_at': expires}},
+                )
+                if previous is None:
+                    continue
+                owned.add(lease['_id'])
+                if previous['owner'] not in (None, self.worker_id):
+                    self.takeovers += 1
+                    print(f"Took over partition {lease['_id']} from {previous['owner']}")
+        self.owned = frozenset(owned)
+        return self.owned
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(
+            target=self._run, name="quicktube-leases", daemon=True
+        )
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.heartbeat_interval):
+            try:
+                self.heartbeat()
+            except PyMongoError as e:
+                print(f"Lease heartbeat failed: {e}")
+
+    def stop(self):
+        # Hands partitions back straight away instead of waiting for expiry
+        self.stopped.set()
+        self.owned = frozenset()
+        self.leases.update_many(
+            {'owner': self.worker_id}, {'$set': {'owner': None, 'expires_at': None}}
+        )
+        self.workers.delete_one({'_id': self.worker_id})
+
+    def stats(self):
+        return {
+            "worker": self.worker_id,
+            "partitions": len(self.owned),
+            "of": self.partitions,
+            "live_workers": self.live_workers,
+            "takeovers": self.takeovers,
+        }
@@ -0,0 +1,240 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from pymongo.errors import BulkWriteError
+from io_pool import execute
+from metrics import CACHE_REQUESTS
+from rate_limit import QuotaExhausted
+from utils import resolve_channel_identifier
+
+BATCH_SIZE = 50  # max IDs per channels().list / videos().list request
+CHANNEL_TTL = 24 * 60 * 60  # 1 day
+HANDLE_TTL = 30 * 24 * 60 * 60  # handles can move, so resolutions expire
+MISSING_TTL = 24 * 60 * 60  # and names that didn't resolve are retried sooner
+
+
+def chunks(items, size=BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class ChannelMetadataCache:
+    # Title, uploads playlist and thumbnail per channel, filled by batched
+    # channels().list calls and kept for CHANNEL_TTL seconds
+    def __init__(self, youtube, quota=None, ttl=CHANNEL_TTL):
+        self.youtube = youtube
+        self.quota = quota
+        self.ttl = ttl
+        self.entries = {}
+
+    def get(self, channel_id, purpose="command"):
+        return self.get_many([channel_id], purpose).get(channel_id)
+
+    def get_many(self, channel_ids, purpose="command"):
+        # Returns {channel_id: {"title", "uploads", "thumbnail"}} for every channel found
+        now = time.monotonic()
+        missing = [
+            channel_id for channel_id in dict.fromkeys(channel_ids)
+            if channel_id not in self.entries or self.entries[channel_id][0] < now
+        ]
+        CACHE_REQUESTS.inc(len(set(channel_ids)) - len(missing), cache="channel", result="hit")
+        CACHE_REQUESTS.inc(len(missing), cache="channel", result="miss")
+        for batch in chunks(missing):
+            self.fetch(batch, purpose)
+        return {
+            channel_id: self.entries[channel_id][1]
+            for channel_id in channel_ids if channel_id in self.entries
+        }
+
+    def fetch(self, channel_ids, purpose="command"):
+        if self.quota:
+            self.quota.charge("channels.list", purpose)
+        response = execute(self.youtube.channels().list(
+            part="snippet,contentDetails", id=",".join(channel_ids), maxResults=BATCH_SIZE
+        ))
+        expires = time.monotonic() + self.ttl
+        for item in response.get("items", []):
+            snippet = item["snippet"]
+            metadata = {
+                "title": snippet["title"],
+                "uploads": item["contentDetails"]["relatedPlaylists"]["uploads"],
+                "thumbnail": snippet["thumbnails"].get("high", {}).get("url"),
+            }
+            self.entries[item["id"]] = (expires, metadata)
+
+    def title(self, channel_id):
+        try:
+            metadata = self.get(channel_id)
+        except QuotaExhausted:
+            metadata = None
+        return metadata["title"] if metadata else "Unknown Channel"
+
+    def find_by_title(self, title, channel_ids):
+        # Resolves a channel name to one of channel_ids; titles aren't unique
+        # across YouTube, so only the guild's own channels are compared
+        title = title.casefold()
+        for channel_id, metadata in self.get_many(channel_ids).items():
+            if metadata["title"].casefold() == title:
+                return channel_id
+        return None
+
+
+class ChannelResolver:
+    # Handle / username / custom URL -> channel ID, shared by every guild and
+    # worker: in memory, then in Mongo, and only then the API. Lookups that
+    # found nothing are remembered too, so a bad name doesn't cost a search
+    # each time someone pastes it.
+    def __init__(self, youtube, collection, io, quota=None):
+        self.youtube = youtube
+        self.collection = collection
+        self.io = io
+        self.quota = quota
+        self.memory = {}  # key -> (expires, channel_id or None)
+        self.lookups = 0
+
+    @staticmethod
+    def key(kind, value):
+        return f"{kind}:{value.casefold()}"
+
+    def setup(self):
+        self.collection.create_index('expires_at', expireAfterSeconds=0)
+
+    async def resolve_many(self, identifiers, purpose="command"):
+        # identifiers are (kind, value) pairs from utils.parse_channel_url.
+        # Returns ({identifier: channel_id or None}, {identifier: error}); the
+        # second holds lookups that couldn't be made, e.g. out of quota.
+        resolved = {}
+        pending = {}
+        now = time.monotonic()
+        for kind, value in dict.fromkeys(identifiers):
+            if kind == "id":
+                resolved[(kind, value)] = value
+                continue
+            key = self.key(kind, value)
+            cached = self.memory.get(key)
+            if cached and cached[0] > now:
+                resolved[(kind, value)] = cached[1]
+            else:
+                pending.setdefault(key, []).append((kind, value))
+        if pending:
+            docs = await self.io.run("mongo", self.load, list(pending))
+            for doc in docs:
+                self.remember(doc['_id'], doc['channel_id'], doc['expires_at'])
+                for identifier in pending.pop(doc['_id'], ()):
+                    resolved[identifier] = doc['channel_id']
+        hits = len(resolved) - sum(kind == "id" for kind, _ in resolved)
+        CACHE_REQUESTS.inc(hits, cache="handle", result="hit")
+        CACHE_REQUESTS.inc(len(pending), cache="handle", result="miss")
+        errors = {}
+        if not pending:
+            return resolved, errors
+        keys = list(pending)
+        results = await asyncio.gather(
+            *(
+                self.io.run(
+                    "youtube", resolve_channel_identifier,
+                    self.youtube, *pending[key][0], self.quota,
+                )
+                for key in keys
+            ),
+            return_exceptions=True,
+        )
+        self.lookups += len(keys)
+        docs = []
+        for key, result in zip(keys, results):
+            if isinstance(result, Exception):
+                for identifier in pending[key]:
+                    errors[identifier] = result
+                continue
+            ttl = HANDLE_TTL if result else MISSING_TTL
+            expires = datetime.now(timezone.utc) + timedelta(seconds=ttl)
+            docs.append({'_id': key, 'channel_id': result, 'expires_at': expires})
+            self.remember(key, result, expires)
+            for identifier in pending[key]:
+                resolved[identifier] = result
+        if docs:
+            await self.io.run("mongo", self.store, docs)
+        return resolved, errors
+
+    def load(self, keys):
+        now = datetime.now(timezone.utc)
+        # TTL deletion runs about once a minute, so expiry is checked here too
+        return [
+            doc for doc in self.collection.find({'_id': {'$in': keys}})
+            if doc['expires_at'].replace(tzinfo=timezone.utc) > now
+        ]
+
+    def store(self, docs):
+        try:
+            self.collection.insert_many(docs, ordered=False)
+        except BulkWriteError:
+            # Already there: another worker resolved it, or an expired entry
+            # TTL hasn't removed yet
+            for doc in docs:
+                self.collection.replace_one({'_id': doc['_id']}, doc, upsert=True)
+
+    def remember(self, key, channel_id, expires_at):
+        remaining = (expires_at.replace(tzinfo=timezone.utc) - datetime.now(timezone.utc)).total_seconds()
+        self.memory[key] = (time.monotonic() + remaining, channel_id)
+
+    def stats(self):
+        return {"cached": len(self.memory), "lookups": self.lookups}
+
+
+class VideoDetailsBatcher:
+    # Coalesces concurrent video lookups into videos().list calls of up to 50 IDs
+    def __init__(self, youtube, io, quota=None, delay=0.05):
+        self.youtube = youtube
+        self.io = io
+        self.quota = quota
+        self.delay = delay
+        self.pending = {}
+        self.timer = None
+
+    async def get(self, video_id):
+        # Returns (video_title, channel_title, thumbnail_url, video_url, publish_date) or None
+        future = self.pending.get(video_id)
+        if future is None:
+            future = self.pending[video_id] = asyncio.get_running_loop().create_future()
+            if len(self.pending) >= BATCH_SIZE:
+                self.flush()
+            elif self.timer is None:
+                self.timer = asyncio.get_running_loop().call_later(self.delay, self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, {}
+        if batch:
+            asyncio.ensure_future(self._resolve(batch))
+
+    async def _resolve(self, batch):
+        try:
+            details = await self.io.run("youtube", self.fetch, list(batch))
+        except Exception as e:
+            print(f"Could not fetch video details for {len(batch)} videos: {e}")
+            details = {}
+        for video_id, future in batch.items():
+            if not future.done():
+                future.set_result(details.get(video_id))
+
+    def fetch(self, video_ids):
+        details = {}
+        for batch in chunks(video_ids):
+            if self.quota:
+                self.quota.charge("videos.list")
+            response = execute(self.youtube.videos().list(
+                part="snippet", id=",".join(batch), maxResults=BATCH_SIZE
+            ))
+            for item in response.get("items", []):
+                snippet = item["snippet"]
+                details[item["id"]] = (
+                    snippet["title"],
+                    snippet["channelTitle"],
+                    snippet["thumbnails"]["high"]["url"],
+                    f"https://www.youtube.com/watch?v={item['id']}",
+                    snippet["publishedAt"],
+                )
+        return details
@@ -0,0 +1,166 @@
+import bisect
+import threading
+from aiohttp import web
+
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metric:
+    def __init__(self, kind, name, description, labels=()):
+        self.kind = kind
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def format_labels(self, key, extra=()):
+        pairs = list(zip(self.label_names, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in items:
+            lines.extend(self.render_value(key, value))
+        return lines
+
+    def render_value(self, key, value):
+        return [f"{self.name}{self.format_labels(key)} {value}"]
+
+
+class Counter(Metric):
+    def __init__(self, name, description, labels=()):
+        super().__init__("counter", name, description, labels)
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    def __init__(self, name, description, labels=()):
+        super().__init__("gauge", name, description, labels)
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__("histogram", name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts, _, _ = entry = self.values[key]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(counts):
+                counts[index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render_value(self, key, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = self.format_labels(key, [("le", str(bound))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        lines.append(f"{self.name}_bucket{self.format_labels(key, [('le', '+Inf')])} {count}")
+        lines.append(f"{self.name}_sum{self.format_labels(key)} {total}")
+        lines.append(f"{self.name}_count{self.format_labels(key)} {count}")
+        return lines
+
+
+REGISTRY = []
+
+IO_SECONDS = Histogram(
+    "quicktube_io_seconds",
+    "Latency of YouTube, transcript, OpenAI, Mongo and Discord calls",
+    ["kind"],
+)
+IO_ERRORS = Counter("quicktube_io_errors_total", "Failed calls by kind", ["kind"])
+QUOTA_UNITS = Counter(
+    "quicktube_youtube_quota_units_total", "YouTube Data API quota units spent", ["method", "purpose"]
+)
+QUOTA_REJECTED = Counter(
+    "quicktube_youtube_quota_rejected_total", "Calls skipped because the daily budget ran out", ["purpose"]
+)
+CACHE_REQUESTS = Counter(
+    "quicktube_cache_requests_total", "Cache lookups by cache and result", ["cache", "result"]
+)
+PIPELINE_ITEMS = Counter(
+    "quicktube_pipeline_items_total", "Items handled by each pipeline stage", ["stage", "result"]
+)
+DETECTOR_REQUESTS = Counter(
+    "quicktube_detector_requests_total",
+    "Feed and playlist polls, by whether the channel had changed",
+    ["source", "result"],
+)
+WEBSUB_NOTIFICATIONS = Counter(
+    "quicktube_websub_notifications_total",
+    "Pushed hub notifications, by what came of them",
+    ["result"],
+)
+WEBSUB_HUB_REQUESTS = Counter(
+    "quicktube_websub_hub_requests_total", "Subscribe and unsubscribe requests to the hub", ["mode", "result"]
+)
+WEBSUB_SUBSCRIPTIONS = Gauge("quicktube_websub_subscriptions", "Channels with a verified hub subscription")
+DISCORD_DELIVERIES = Counter(
+    "quicktube_discord_deliveries_total", "Summary posts by outcome, retries included", ["result"]
+)
+DISCORD_DELIVERY_SECONDS = Histogram(
+    "quicktube_discord_delivery_seconds",
+    "Time from queueing a post to Discord accepting it",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+OPENAI_RETRIES = Counter("quicktube_openai_retries_total", "Retried OpenAI requests")
+SWEEP_SECONDS = Histogram(
+    "quicktube_sweep_seconds",
+    "Wall time to poll one batch of due channels",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1200),
+)
+SWEEP_CHANNELS = Gauge("quicktube_sweep_channels", "Channels polled in the last sweep")
+CHECK_INTERVAL = Gauge("quicktube_check_interval_seconds", "Default poll interval a sweep should fit in")
+MONITORED_CHANNELS = Gauge("quicktube_monitored_channels", "Unique YouTube channels being monitored")
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def start_server(host="127.0.0.1", port=9108):
+    # Serves /metrics in Prometheus text format on the bot's event loop
+    async def handle(request):
+        return web.Response(
+            text=render(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
@@ -1,42 +1,90 @@
 from pymongo import MongoClient
-from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError, OperationFailure
+from summary_cache import SUMMARY_TTL
+
+def shard_of(guild_id, shard_count):
+    # Discord's guild -> shard mapping
+    return (guild_id >> 22) % shard_count
+
 
 class MongoDBWorker:
-    def __init__(self, yt_api_key, discord_token):
+    def __init__(self, yt_api_key, discord_token, client=None, database='QuickTubeServers'):
         self.yt_api_key = yt_api_key
         self.discord_token = discord_token
-        self.client = MongoClient('mongodb://localhost:27017/')
+        self.client = client or MongoClient('mongodb://localhost:27017/')
         # create the database if it doesn't exist
-        self.db = self.client['QuickTubeServers']  # Change the database name
+        self.db = self.client[database]
         self.servers = self.db.servers
+        self.summaries = self.db.summaries
+        self.chunk_summaries = self.db.chunk_summaries
+        self.leases = self.db.leases
+        self.workers = self.db.workers
+        self.jobs = self.db.summary_jobs
+        self.meta = self.db.meta
+        self.handles = self.db.channel_handles
+        self.backfills = self.db.backfills
+        self.youtube_quota = self.db.youtube_quota
 
-    def initial_sync(self, guild_ids):
-        for guild_id in guild_ids:
-            if not self.server_exists(guild_id):
-                self.new_server(guild_id)
+    def initial_sync(self, guild_ids, shard_ids=None, shard_count=None):
+        # guild_ids are every guild this process is in. With shard_ids set it
+        # only runs those shards, and can only tell about guilds on them.
+        # Cached summaries expire on their own
+        self.summaries.create_index('created_at', expireAfterSeconds=SUMMARY_TTL)
+        self.chunk_summaries.create_index('created_at', expireAfterSeconds=SUMMARY_TTL)
+        try:
+            self.servers.create_index('guild_id', unique=True)
+        except OperationFailure as e:
+            print(f"Could not create unique guild_id index (duplicate server entries?): {e}")
+        # One query for the guilds we already know, one insert for the rest
+        guild_ids = list(guild_ids)
+        existing = {
+            server['guild_id']
+            for server in self.servers.find({'guild_id': {'$in': guild_ids}}, {'guild_id': 1})
+        }
+        missing = [guild_id for guild_id in dict.fromkeys(guild_ids) if guild_id not in existing]
+        if missing:
+            try:
+                self.servers.insert_many(
+                    [self.server_defaults(guild_id) for guild_id in missing], ordered=False
+                )
+            except BulkWriteError as e:
+                # Another process inserted some of them first
+                print(f"Some server entries already existed: {e.details['nInserted']} inserted")
         # Check to make sure all servers have current attributes
-        for server in self.servers.find():
-            if 'yt_api_key' not in server:
-                server['yt_api_key'] = self.yt_api_key
-                self.servers.replace_one({'_id': ObjectId(server['_id'])}, server)
-            if 'discord_token' not in server:
-                server['discord_token'] = self.discord_token
-                self.servers.replace_one({'_id': ObjectId(server['_id'])}, server)
-            if 'update_channel' not in server:
-                server['update_channel'] = "None"
-                self.servers.replace_one({'_id': ObjectId(server['_id'])}, server)
-            if 'openai_key' not in server:
-                server['openai_key'] = "None"
-                self.servers.replace_one({'_id': ObjectId(server['_id'])}, server)
-            if 'monitored_channels' not in server:
-                server['monitored_channels'] = []
-                self.servers.replace_one({'_id': ObjectId(server['_id'])}, server)
-            if 'last_video_ids' not in server:
-                server['last_video_ids'] = []
-                self.servers.replace_one({'_id': ObjectId(server['_id'])}, server)
+        for field, value in self.server_defaults(None).items():
+            if field != 'guild_id':
+                self.servers.update_many({field: {'$exists': False}}, {'$set': {field: value}})
+        # Older documents stored last_video_ids as a list
+        self.servers.update_many(
+            {'last_video_ids': {'$type': 'array'}}, {'$set': {'last_video_ids': {}}}
+        )
+        # Guilds left while we were offline stay in the database but aren't
+        # polled for; rejoined ones are picked up again
+        self.servers.update_many(
+            {'guild_id': {'$in': guild_ids}, 'active': False},
+            {'$set': {'active': True}, '$inc': {'version': 1}},
+        )
+        left = [
+            server['guild_id']
+            for server in self.servers.find(
+                {'guild_id': {'$nin': guild_ids}, 'active': {'$ne': False}}, {'guild_id': 1}
+            )
+            if shard_ids is None or shard_of(server['guild_id'], shard_count) in shard_ids
+        ]
+        if left:
+            self.servers.update_many(
+                {'guild_id': {'$in': left}}, {'$set': {'active': False}, '$inc': {'version': 1}}
+            )
+
+    def get_meta(self, key):
+        doc = self.meta.find_one({'_id': key})
+        return doc['value'] if doc else None
+
+    def set_meta(self, key, value):
+        self.meta.replace_one({'_id': key}, {'_id': key, 'value': value}, upsert=True)
 
     def server_exists(self, guild_id):
-        return self.servers.find_one({'guild_id': guild_id}) is not None
+        return self.servers.find_one({'guild_id': guild_id}, {'_id': 1}) is not None
 
     def get_server(self, guild_id):
         return self.servers.find_one({'guild_id': guild_id})
@@ -49,16 +97,38 @@ class MongoDBWorker:
         server = self.servers.find_one({'guild_id': guild_id})
         return server.get('openai_key') if server else None
 
-    def new_server(self, guild_id):
-        server_data = {
+    def set_last_video_id(self, guild_id, channel_id, video_id):
+        # Older documents stored last_video_ids as a list
+        self.servers.update_one(
+            {'guild_id': guild_id, 'last_video_ids': {'$type': 'array'}},
+            {'$set': {'last_video_ids': {}}}
+        )
+        self.servers.update_one(
+            {'guild_id': guild_id},
+            {'$set': {f'last_video_ids.{channel_id}': video_id}, '$inc': {'version': 1}}
+        )
+
+    def mark_seen(self, guild_ids, channel_id, video_id):
+        # One write for every guild a new upload was queued for
+        self.servers.update_many(
+            {'guild_id': {'$in': list(guild_ids)}},
+            {'$set': {f'last_video_ids.{channel_id}': video_id}, '$inc': {'version': 1}}
+        )
+
+    def server_defaults(self, guild_id):
+        return {
             'guild_id': guild_id,
             'monitored_channels': [],
             'update_channel': "None",
             'openai_key': "None",
             'yt_api_key': self.yt_api_key,
+            'discord_token': self.discord_token,
             'last_video_ids': {},
+            'active': True,
         }
-        self.servers.insert_one(server_data)
+
+    def new_server(self, guild_id):
+        self.servers.insert_one(self.server_defaults(guild_id))
 
 # Example usage
 # mongo_worker = MongoDBWorker('your_yt_api_key', 'your_discord_token')
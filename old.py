@@ -1,14 +1,19 @@
 import argparse
 import time
 from googleapiclient.discovery import build
-from youtube_transcript_api import YouTubeTranscriptApi
-from gpt import summarize
+from gpt import summarize_batch, summarize_long
+from detector import UploadDetector
+from transcripts import TranscriptStore
 
 # Setting up argument parser
 parser = argparse.ArgumentParser(description="Fetch YouTube video transcripts.")
 parser.add_argument("--api-key", type=str, help="YouTube Data API Key")
 parser.add_argument("--openai-key", type=str, help="YouTube Channel ID")
 parser.add_argument("--channel-id", type=str, help="YouTube Channel ID")
+parser.add_argument(
+    "--backfill", type=int, default=0,
+    help="Summarize this many of the channel's latest videos in one batch, then exit",
+)
 
 args = parser.parse_args()
 
@@ -16,40 +21,54 @@ args = parser.parse_args()
 check_interval = 600  # 10 minutes
 
 
-def get_latest_video_id(youtube):
-    request = youtube.search().list(
-        part="snippet", channelId=args.channel_id, maxResults=1, order="date"
-    )
-    response = request.execute()
+def get_latest_video_id(detector):
+    return detector.get_latest_video(args.channel_id)[0]
 
-    if response["items"]:
-        return response["items"][0]["id"]["videoId"]
-    else:
-        return None
+
+transcripts = TranscriptStore()
 
 
 def fetch_transcript(video_id):
     transcript_text = ""
     try:
-        transcript = YouTubeTranscriptApi.get_transcript(video_id)
-        for text in transcript:
-            transcript_text += text["text"] + " "
+        transcript = transcripts.get(video_id)
+        transcript_text = " ".join(text["text"] for text in transcript)
     except Exception as e:
         print(f"Could not get transcript for video ID {video_id}: {e}")
     return transcript_text
 
 
+def backfill(detector):
+    # One Batch API job for the whole back catalogue instead of a request per video
+    videos = detector.recent_uploads(args.channel_id, args.backfill)
+    contents = {}
+    for video in videos:
+        transcript_text = fetch_transcript(video[0])
+        if transcript_text:
+            contents[video[0]] = transcript_text[:4000]
+    print(f"Summarizing {len(contents)} of {len(videos)} videos in one batch...")
+    summaries = summarize_batch(contents, args.openai_key)
+    for video in reversed(videos):
+        if video[0] in summaries:
+            print(f"{video[1]} ({video[4]})")
+            print(summaries[video[0]])
+
+
 def main():
     youtube = build("youtube", "v3", developerKey=args.api_key)
+    detector = UploadDetector(youtube)
     last_video_id = None
+    if args.backfill:
+        backfill(detector)
+        return
 
     while True:
-        current_video_id = get_latest_video_id(youtube)
+        current_video_id = get_latest_video_id(detector)
 
         if current_video_id and current_video_id != last_video_id:
             print(f"New video found: {current_video_id}")
             transcript_text = fetch_transcript(current_video_id)
-            print(summarize(transcript_text, args.openai_key))
+            print(summarize_long(transcript_text, args.openai_key))
             last_video_id = current_video_id
 
         time.sleep(check_interval)
@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+from metrics import PIPELINE_ITEMS
+
+
+class Stage:
+    def __init__(self, name, handler, workers, queue_size):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.tasks = []
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.started = time.monotonic()
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {
+            "workers": self.workers,
+            "queued": self.queue.qsize(),
+            "processed": self.processed,
+            "failed": self.failed,
+            "per_second": self.processed / elapsed,
+            "avg_latency": self.busy / self.processed if self.processed else 0.0,
+            # Fraction of worker time spent handling items; near 1.0 means add workers
+            "utilization": self.busy / (elapsed * self.workers),
+        }
+
+
+class Pipeline:
+    # Chain of asyncio stages, each with its own bounded queue and worker count.
+    # A handler returns None to drop an item, a list to fan out, or a single
+    # item to hand to the next stage. Full queues block upstream workers.
+    def __init__(self):
+        self.stages = []
+
+    def add_stage(self, name, handler, workers=4, queue_size=100):
+        self.stages.append(Stage(name, handler, workers, queue_size))
+        return self
+
+    def start(self):
+        if any(stage.tasks for stage in self.stages):
+            return  # already running
+        for index, stage in enumerate(self.stages):
+            next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            for _ in range(stage.workers):
+                stage.tasks.append(asyncio.create_task(self._worker(stage, next_stage)))
+
+    async def stop(self):
+        for stage in self.stages:
+            for task in stage.tasks:
+                task.cancel()
+            await asyncio.gather(*stage.tasks, return_exceptions=True)
+            stage.tasks = []
+
+    async def submit(self, item, stage=None):
+        # Starts the item at the named stage, or the first one
+        target = self.stages[0]
+        if stage is not None:
+            target = next(s for s in self.stages if s.name == stage)
+        await target.queue.put(item)
+
+    async def join(self):
+        # Items only move forward, so joining stages in order drains the pipeline
+        for stage in self.stages:
+            await stage.queue.join()
+
+    def reset_stats(self):
+        for stage in self.stages:
+            stage.reset_stats()
+
+    def stats(self):
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    async def _worker(self, stage, next_stage):
+        while True:
+            item = await stage.queue.get()
+            start = time.monotonic()
+            try:
+                result = await stage.handler(item)
+                stage.processed += 1
+                PIPELINE_ITEMS.inc(stage=stage.name, result="ok")
+            except Exception as e:
+                stage.failed += 1
+                PIPELINE_ITEMS.inc(stage=stage.name, result="failed")
+                print(f"Pipeline stage {stage.name} failed: {e}")
+                result = None
+            finally:
+                stage.busy += time.monotonic() - start
+            try:
+                if next_stage is not None and result is not None:
+                    for output in result if isinstance(result, list) else [result]:
+                        await next_stage.queue.put(output)
+            finally:
+                stage.queue.task_done()
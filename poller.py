@@ -0,0 +1,46 @@
+class SubscriptionIndex:
+    # Inverted index of YouTube channel ID -> {guild_id: update_channel}
+    # so every channel is polled once per sweep no matter how many guilds follow it.
+    def __init__(self):
+        self.subscriptions = {}
+        self.update_channels = {}
+
+    def rebuild(self, servers):
+        self.subscriptions = {}
+        self.update_channels = {}
+        for server in servers:
+            self.update_channels[server['guild_id']] = server.get('update_channel')
+            for channel_id in server.get('monitored_channels') or []:
+                self.subscribe(channel_id, server['guild_id'])
+
+    def subscribe(self, channel_id, guild_id):
+        self.subscriptions.setdefault(channel_id, set()).add(guild_id)
+
+    def unsubscribe(self, channel_id, guild_id):
+        guilds = self.subscriptions.get(channel_id)
+        if guilds is None:
+            return
+        guilds.discard(guild_id)
+        if not guilds:
+            del self.subscriptions[channel_id]
+
+    def set_update_channel(self, guild_id, update_channel):
+        self.update_channels[guild_id] = update_channel
+
+    def remove_guild(self, guild_id):
+        for channel_id in list(self.subscriptions):
+            self.unsubscribe(channel_id, guild_id)
+        self.update_channels.pop(guild_id, None)
+
+    def channels(self):
+        return list(self.subscriptions)
+
+    def subscribers(self, channel_id):
+        # Returns (guild_id, update_channel) pairs for a YouTube channel
+        return [
+            (guild_id, self.update_channels.get(guild_id))
+            for guild_id in self.subscriptions.get(channel_id, ())
+        ]
+
+    def __len__(self):
+        return len(self.subscriptions)
@@ -0,0 +1,190 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from metrics import QUOTA_REJECTED, QUOTA_UNITS
+
+# YouTube Data API quota cost per call, see https://developers.google.com/youtube/v3/determine_quota_cost
+QUOTA_COSTS = {
+    "search.list": 100,
+    "channels.list": 1,
+    "playlistItems.list": 1,
+    "videos.list": 1,
+}
+
+PACIFIC = ZoneInfo("America/Los_Angeles")
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate  # tokens added per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, tokens=1):
+        # Takes tokens if available and returns 0, otherwise returns the seconds to wait
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+
+class KeyRateLimiter:
+    # One token bucket per API key, so a busy guild can't exhaust its own
+    # OpenAI rate limit and start failing mid-sweep. Blocks the calling thread.
+    def __init__(self, rate=0.5, capacity=10):
+        self.rate = rate
+        self.capacity = capacity
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.waits = 0
+        self.waited = 0.0
+
+    def bucket(self, key):
+        with self.lock:
+            if key not in self.buckets:
+                self.buckets[key] = TokenBucket(self.rate, self.capacity)
+            return self.buckets[key]
+
+    def acquire(self, key, tokens=1):
+        bucket = self.bucket(key)
+        while True:
+            wait = bucket.take(tokens)
+            if not wait:
+                return
+            with self.lock:
+                self.waits += 1
+                self.waited += wait
+            time.sleep(wait)
+
+    def stats(self):
+        return {"keys": len(self.buckets), "waits": self.waits, "waited": self.waited}
+
+
+class QuotaExhausted(Exception):
+    pass
+
+
+class QuotaCounter:
+    # Tracks YouTube quota units spent per API method against the daily budget.
+    # Polling may only spend up to (1 - command_reserve) of the day's units so
+    # slash-command lookups always have some left. With a collection, the
+    # day's spend is one document per API key that every worker charges
+    # atomically, since they all draw on the same quota.
+    MAX_SLOWDOWN = 8
+
+    def __init__(self, daily_units=10000, command_reserve=0.2, collection=None, key_id="default"):
+        self.daily_units = daily_units
+        self.command_reserve = command_reserve
+        self.collection = collection
+        self.key_id = key_id
+        self.units = 0
+        self.calls = {}
+        self.day = self.today()
+        self.spent = {"poll": 0, "command": 0}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def today():
+        # The YouTube quota resets at midnight Pacific time
+        return datetime.now(PACIFIC).date()
+
+    def roll_over(self):
+        if self.today() != self.day:
+            self.day = self.today()
+            self.spent = {"poll": 0, "command": 0}
+
+    def setup(self):
+        if self.collection is not None:
+            self.collection.create_index('expires_at', expireAfterSeconds=0)
+
+    def load(self):
+        # The day's spend so far, by every worker and before any restart, so
+        # poll_slowdown keeps pacing from where the budget really is
+        if self.collection is None:
+            return
+        with self.lock:
+            self.roll_over()
+        doc = self.collection.find_one({'_id': self.doc_id()})
+        with self.lock:
+            self.spent = {"poll": 0, "command": 0, **(doc or {}).get('spent', {})}
+
+    def doc_id(self):
+        return f"{self.key_id}:{self.day.isoformat()}"
+
+    def charge(self, method, purpose="command"):
+        cost = QUOTA_COSTS.get(method, 1)
+        with self.lock:
+            self.roll_over()
+            limit = self.daily_units
+            if purpose == "poll":
+                limit *= 1 - self.command_reserve
+            local = self.collection is None
+            if local and sum(self.spent.values()) + cost > limit:
+                self.reject(method, purpose)
+        if not local:
+            local = not self.reserve(method, purpose, cost, limit)
+        with self.lock:
+            if local:
+                self.spent[purpose] = self.spent.get(purpose, 0) + cost
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.units += cost
+        QUOTA_UNITS.inc(cost, method=method, purpose=purpose)
+
+    def reserve(self, method, purpose, cost, limit):
+        # Takes cost units from the shared day's budget in one atomic update.
+        # Returns False if Mongo can't be reached, to count locally instead.
+        try:
+            doc = self.collection.find_one_and_update(
+                {'_id': self.doc_id(), 'total': {'$lte': limit - cost}},
+                {
+                    '$inc': {'total': cost, f'spent.{purpose}': cost},
+                    # Kept a little past the day, then dropped by the TTL index
+                    '$setOnInsert': {'expires_at': datetime.now(timezone.utc) + timedelta(days=2)},
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # The day's document exists but has no room left for cost
+            self.reject(method, purpose)
+        except PyMongoError as e:
+            print(f"Could not charge the shared YouTube quota: {e}")
+            return False
+        with self.lock:
+            self.spent = {"poll": 0, "command": 0, **doc.get('spent', {})}
+        return True
+
+    def reject(self, method, purpose):
+        QUOTA_REJECTED.inc(purpose=purpose)
+        raise QuotaExhausted(f"Daily YouTube quota budget reached, skipping {method}")
+
+    def poll_slowdown(self):
+        # How much to stretch poll intervals: above 1 when polling is spending
+        # its share faster than the day is passing
+        with self.lock:
+            self.roll_over()
+            used = self.spent["poll"] / (self.daily_units * (1 - self.command_reserve))
+        now = datetime.now(PACIFIC)
+        elapsed = (now.hour * 3600 + now.minute * 60 + now.second) / 86400
+        elapsed = max(elapsed, 1 / 24)
+        if used <= elapsed:
+            return 1.0
+        return min(used / elapsed, self.MAX_SLOWDOWN)
+
+    def snapshot(self):
+        return {
+            "units": self.units,
+            "calls": dict(self.calls),
+            "today": dict(self.spent),
+            "remaining": self.daily_units - sum(self.spent.values()),
+        }
@@ -0,0 +1,118 @@
+import heapq
+import random
+import time
+from collections import deque
+from datetime import datetime
+
+
+def parse_timestamp(published_at):
+    try:
+        return datetime.fromisoformat(published_at.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+class PollScheduler:
+    # Min-heap of (next poll time, channel_id). Each channel's interval follows
+    # its upload history: roughly POLL_FRACTION of the expected gap between
+    # uploads, clamped to [min_interval, max_interval] plus a little jitter.
+    # Channels uploading daily or more never poll slower than default_interval,
+    # the old fixed sweep; feed polls cost no quota, so only quiet channels back off.
+    POLL_FRACTION = 1 / 144
+    ACTIVE_GAP = 24 * 60 * 60
+
+    def __init__(
+        self, default_interval=600, min_interval=300, max_interval=6 * 60 * 60,
+        jitter=0.1, history=10,
+    ):
+        self.default_interval = default_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.history = history
+        self.heap = []
+        self.next_poll = {}
+        self.uploads = {}
+        self.slowdown = 1.0  # raised when the YouTube quota budget runs low
+        # Channels a WebSub hub pushes uploads for only need an occasional
+        # poll to catch anything a push missed
+        self.pushed = set()
+        self.push_interval = max_interval
+
+    def __len__(self):
+        return len(self.next_poll)
+
+    def sync(self, channel_ids):
+        # Start polling new channels straight away, forget removed ones
+        channel_ids = set(channel_ids)
+        for channel_id in channel_ids - set(self.next_poll):
+            self.schedule(channel_id, 0)
+        for channel_id in set(self.next_poll) - channel_ids:
+            del self.next_poll[channel_id]
+            self.uploads.pop(channel_id, None)
+
+    def schedule(self, channel_id, delay):
+        when = time.monotonic() + delay
+        self.next_poll[channel_id] = when
+        heapq.heappush(self.heap, (when, channel_id))
+
+    def due(self):
+        now = time.monotonic()
+        channel_ids = []
+        while self.heap and self.heap[0][0] <= now:
+            when, channel_id = heapq.heappop(self.heap)
+            # Skip stale heap entries left behind by reschedules and removals
+            if self.next_poll.get(channel_id) == when:
+                channel_ids.append(channel_id)
+        return channel_ids
+
+    def seconds_until_next(self):
+        while self.heap and self.next_poll.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return self.default_interval
+        return max(0.0, self.heap[0][0] - time.monotonic())
+
+    def record(self, channel_id, published_at):
+        # Called after every poll with the latest upload's publish date (or None)
+        if channel_id not in self.next_poll:
+            return
+        timestamp = parse_timestamp(published_at)
+        if timestamp is not None:
+            uploads = self.uploads.setdefault(channel_id, deque(maxlen=self.history))
+            if not uploads or timestamp > uploads[-1]:
+                uploads.append(timestamp)
+        self.schedule(channel_id, self.interval(channel_id))
+
+    def interval(self, channel_id):
+        uploads = self.uploads.get(channel_id)
+        active = False
+        if not uploads:
+            interval = self.default_interval
+        else:
+            since_last = time.time() - uploads[-1]
+            if len(uploads) > 1:
+                mean_gap = (uploads[-1] - uploads[0]) / (len(uploads) - 1)
+            else:
+                mean_gap = since_last
+            # A channel that has been quiet longer than usual is probably dormant
+            gap = max(mean_gap, since_last)
+            interval = gap * self.POLL_FRACTION
+            active = gap <= self.ACTIVE_GAP
+        interval = min(max(interval, self.min_interval), self.max_interval)
+        # Jitter upwards only so polls spread out without breaking the minimum
+        interval = min(interval * random.uniform(1, 1 + self.jitter), self.max_interval)
+        if active:
+            interval = min(interval, max(self.default_interval, self.min_interval))
+        if channel_id in self.pushed:
+            interval = max(interval, self.push_interval)
+        return interval * self.slowdown
+
+    def stats(self):
+        intervals = [self.interval(channel_id) for channel_id in self.next_poll]
+        return {
+            "channels": len(self.next_poll),
+            "avg_interval": sum(intervals) / len(intervals) if intervals else 0,
+            # Expected polls per hour across all channels
+            "polls_per_hour": sum(3600 / interval for interval in intervals),
+        }
@@ -0,0 +1,117 @@
+import asyncio
+import hashlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from metrics import CACHE_REQUESTS
+
+SUMMARY_TTL = 30 * 24 * 60 * 60  # 30 days
+
+
+def summary_key(video_id, model, prompt):
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+    return f"{video_id}:{model}:{prompt_hash}"
+
+
+class SummaryCache:
+    # Two-tier summary cache: in-process LRU in front of a Mongo collection
+    # with a TTL index. Concurrent requests for one key share a single computation.
+    def __init__(self, collection, io, max_entries=1024):
+        self.collection = collection
+        self.io = io
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            CACHE_REQUESTS.inc(cache="summary", result="memory")
+            return self.memory[key]
+        doc = await self.io.run("mongo", self.collection.find_one, {"_id": key})
+        if doc:
+            self.hits += 1
+            CACHE_REQUESTS.inc(cache="summary", result="mongo")
+            self._remember(key, doc["summary"])
+            return doc["summary"]
+        return None
+
+    async def get_or_create(self, key, compute):
+        # compute is an async callable that produces the summary on a miss
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            CACHE_REQUESTS.inc(cache="summary", result="memory")
+            return self.memory[key]
+        task = self.inflight.get(key)
+        if task is None:
+            task = self.inflight[key] = asyncio.ensure_future(self._load(key, compute))
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        else:
+            self.hits += 1
+            CACHE_REQUESTS.inc(cache="summary", result="inflight")
+        return await asyncio.shield(task)
+
+    async def _load(self, key, compute):
+        cached = await self.get(key)
+        if cached is not None:
+            return cached
+        self.misses += 1
+        CACHE_REQUESTS.inc(cache="summary", result="miss")
+        summary = await compute()
+        if summary:
+            await self.set(key, summary)
+        return summary
+
+    async def set(self, key, summary):
+        await self.io.run(
+            "mongo",
+            self.collection.replace_one,
+            {"_id": key},
+            {"_id": key, "summary": summary, "created_at": datetime.now(timezone.utc)},
+            upsert=True,
+        )
+        self._remember(key, summary)
+
+    def _remember(self, key, summary):
+        self.memory[key] = summary
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.memory)}
+
+
+class ChunkStore:
+    # Synchronous per-chunk summary store for gpt.summarize_long, used from
+    # worker threads. Partial summaries persist in Mongo so retries skip them.
+    def __init__(self, collection, max_entries=4096):
+        self.collection = collection
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+
+    def get(self, key):
+        if key in self.memory:
+            return self.memory[key]
+        doc = self.collection.find_one({"_id": key})
+        if doc:
+            self._remember(key, doc["summary"])
+            return doc["summary"]
+        return None
+
+    def __setitem__(self, key, summary):
+        self.collection.replace_one(
+            {"_id": key},
+            {"_id": key, "summary": summary, "created_at": datetime.now(timezone.utc)},
+            upsert=True,
+        )
+        self._remember(key, summary)
+
+    def _remember(self, key, summary):
+        self.memory[key] = summary
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
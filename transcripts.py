@@ -0,0 +1,150 @@
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from metrics import CACHE_REQUESTS
+
+DEFAULT_LANGUAGES = ("en",)
+
+
+def fetch_from_youtube(video_id, languages=DEFAULT_LANGUAGES):
+    # Returns (language_code, segments) for the first available language
+    from youtube_transcript_api import YouTubeTranscriptApi
+
+    if hasattr(YouTubeTranscriptApi, "list_transcripts"):
+        transcripts = YouTubeTranscriptApi.list_transcripts(video_id)  # before 1.0
+    else:
+        transcripts = YouTubeTranscriptApi().list(video_id)
+    transcript = transcripts.find_transcript(languages)
+    segments = transcript.fetch()
+    if hasattr(segments, "to_raw_data"):
+        segments = segments.to_raw_data()
+    return transcript.language_code, list(segments)
+
+
+class TranscriptStore:
+    # Full transcripts (every segment, with timings) kept on local disk as
+    # gzipped JSON, one file per video and language. Files are only read when
+    # asked for, and the directory is kept under max_bytes by evicting the
+    # least recently used. A few decoded transcripts stay in memory.
+    def __init__(
+        self, directory="transcripts", max_bytes=512 * 1024 * 1024, memory_entries=32,
+        fetcher=fetch_from_youtube,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.fetcher = fetcher
+        self.memory = OrderedDict()
+        self.files = None  # path -> size, least recently used first; built on first use
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.fetches = 0
+
+    def path(self, video_id, language):
+        return os.path.join(self.directory, f"{video_id}.{language}.json.gz")
+
+    def get(self, video_id, languages=DEFAULT_LANGUAGES):
+        # Segments in the first of `languages` we have or can fetch
+        for language in languages:
+            segments = self.load(video_id, language)
+            if segments is not None:
+                return segments
+        CACHE_REQUESTS.inc(cache="transcript", result="miss")
+        language, segments = self.fetcher(video_id, languages)
+        with self.lock:
+            self.fetches += 1
+        self.save(video_id, language, segments)
+        return segments
+
+    def load(self, video_id, language):
+        key = (video_id, language)
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                CACHE_REQUESTS.inc(cache="transcript", result="memory")
+                return self.memory[key]
+            self.scan()
+            path = self.path(video_id, language)
+            if path not in self.files:
+                return None
+            self.files.move_to_end(path)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                segments = json.load(f)
+            os.utime(path)  # keeps the LRU order across restarts
+        except (OSError, ValueError) as e:
+            print(f"Dropping unreadable transcript {path}: {e}")
+            self.remove(path)
+            return None
+        with self.lock:
+            self.hits += 1
+            self.remember(key, segments)
+        CACHE_REQUESTS.inc(cache="transcript", result="disk")
+        return segments
+
+    def save(self, video_id, language, segments):
+        path = self.path(video_id, language)
+        data = gzip.compress(json.dumps(segments, separators=(",", ":")).encode("utf-8"))
+        os.makedirs(self.directory, exist_ok=True)
+        # Written to the side and renamed, so readers never see half a file
+        temp = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp, "wb") as f:
+            f.write(data)
+        os.replace(temp, path)
+        with self.lock:
+            self.scan()
+            self.bytes += len(data) - self.files.pop(path, 0)
+            self.files[path] = len(data)
+            self.remember((video_id, language), segments)
+            evicted = []
+            while self.bytes > self.max_bytes and len(self.files) > 1:
+                oldest, size = self.files.popitem(last=False)
+                self.bytes -= size
+                evicted.append(oldest)
+        for oldest in evicted:
+            try:
+                os.remove(oldest)
+            except OSError:
+                pass
+
+    def remove(self, path):
+        with self.lock:
+            self.bytes -= self.files.pop(path, 0)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def remember(self, key, segments):
+        self.memory[key] = segments
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def scan(self):
+        # One directory listing, oldest access first; called with the lock held
+        if self.files is not None:
+            return
+        entries = []
+        if os.path.isdir(self.directory):
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith(".json.gz"):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, entry.path, stat.st_size))
+        entries.sort()
+        self.files = OrderedDict((path, size) for _, path, size in entries)
+        self.bytes = sum(self.files.values())
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "fetches": self.fetches,
+            "files": len(self.files or ()),
+            "bytes": self.bytes,
+        }
@@ -1,40 +1,99 @@
 import re
+from io_pool import execute
+from rate_limit import QuotaExhausted
+
+VIDEO_URL_PATTERN = re.compile(
+    r"(?:https?:\/\/)?(?:www\.)?(?:youtube\.com\/watch\?v=|youtu.be\/)([a-zA-Z0-9_-]{11})"
+)
+CHANNEL_URL_PATTERN = re.compile(
+    r"(?:https?:\/\/)?(?:www\.|m\.)?youtube\.com\/(channel\/|c\/|@|user\/)?([a-zA-Z0-9_.-]+)"
+)
+CHANNEL_ID_PATTERN = re.compile(r"UC[a-zA-Z0-9_-]{22}")
+HANDLE_PATTERN = re.compile(r"@([a-zA-Z0-9_.-]+)")
+URL_SEPARATOR_PATTERN = re.compile(r"[\s,]+")
+CHANNEL_URL_KINDS = {"channel/": "id", "@": "handle", "user/": "user", "c/": "custom"}
+# First path segments of youtube.com URLs that are not channels; these would
+# otherwise be looked up (and searched for) as old custom channel names
+RESERVED_PATHS = {
+    "watch", "shorts", "playlist", "results", "feed", "live", "embed",
+    "hashtag", "post", "clip", "channel", "c", "user",
+}
 
 
 def extract_video_id_from_url(url):
-    # Regex pattern for YouTube video URL
-    pattern = r"(?:https?:\/\/)?(?:www\.)?(?:youtube\.com\/watch\?v=|youtu.be\/)([a-zA-Z0-9_-]{11})"
-    match = re.search(pattern, url)
+    match = VIDEO_URL_PATTERN.search(url)
     return match.group(1) if match else None
 
 def extract_channel_identifier_from_url(url):
-    # Pattern to match channel ID or channel/user name
-    pattern = r"(?:https?:\/\/)?(?:www\.)?youtube\.com\/(?:channel\/|c\/|@|user\/)?([a-zA-Z0-9_-]+)"
-    match = re.search(pattern, url)
-    return match.group(1) if match else None
+    # Channel ID or channel/user name
+    match = CHANNEL_URL_PATTERN.search(url)
+    return match.group(2) if match else None
 
-def get_channel_id_from_name(youtube, name):
-    try:
-        # First, try to get the channel by username
-        request = youtube.channels().list(forUsername=name, part="id")
-        response = request.execute()
+def split_channel_urls(text):
+    # Many URLs in one string, separated by spaces, commas or newlines
+    return [url for url in URL_SEPARATOR_PATTERN.split(text) if url]
+
+def parse_channel_url(url):
+    # Returns (kind, value) with kind "id", "handle", "user" or "custom", or None.
+    # Bare @handles and channel IDs are accepted too.
+    if CHANNEL_ID_PATTERN.fullmatch(url):
+        return ("id", url)
+    match = HANDLE_PATTERN.fullmatch(url)
+    if match:
+        return ("handle", match.group(1))
+    match = CHANNEL_URL_PATTERN.search(url)
+    if not match:
+        return None
+    prefix, value = match.groups()
+    if prefix:
+        kind = CHANNEL_URL_KINDS[prefix]
+        if kind == "id" and not CHANNEL_ID_PATTERN.fullmatch(value):
+            return None
+        return (kind, value)
+    if CHANNEL_ID_PATTERN.fullmatch(value):
+        return ("id", value)
+    if value.casefold() in RESERVED_PATHS:
+        return None
+    return ("custom", value)
+
+def resolve_channel_identifier(youtube, kind, value, quota=None):
+    # kind is "handle", "user" or "custom"; returns the channel ID or None.
+    # channels.list lookups cost 1 unit each, the search fallback 100.
+    parameters = {
+        "handle": [("forHandle", f"@{value}")],
+        "user": [("forUsername", value)],
+        "custom": [("forHandle", f"@{value}"), ("forUsername", value)],
+    }[kind]
+    for name, argument in parameters:
+        if quota:
+            quota.charge("channels.list")
+        response = execute(youtube.channels().list(part="id", **{name: argument}))
         if response.get("items"):
             return response["items"][0]["id"]
-        else:
-            # If no channel found with username, try to search with custom URL (c/ or @)
-            request = youtube.search().list(
-                q=name, part="snippet", type="channel", maxResults=1
-            )
-            response = request.execute()
-            if response.get("items"):
-                return response["items"][0]["snippet"]["channelId"]
+    if kind == "handle":
+        return None  # handles are exact, a search would only guess
+    # Old custom (c/) URLs have no lookup of their own
+    if quota:
+        quota.charge("search.list")
+    response = execute(youtube.search().list(
+        q=value, part="snippet", type="channel", maxResults=1
+    ))
+    if response.get("items"):
+        return response["items"][0]["snippet"]["channelId"]
+    return None
+
+def get_channel_id_from_name(youtube, name, quota=None):
+    try:
+        return resolve_channel_identifier(youtube, "custom", name, quota)
+    except QuotaExhausted:
+        raise
     except Exception as e:
         print(f"Error in getting channel ID from name: {e}")
     return None
 
 def get_channel_name(youtube, channel_id):
     request = youtube.channels().list(part="snippet", id=channel_id)
-    response = request.execute()
+    response = execute(request)
 
     if response["items"]:
         return response["items"][0]["snippet"]["title"]
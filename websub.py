@@ -0,0 +1,212 @@
+import asyncio
+import hmac
+import secrets
+import time
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlparse
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, web
+
+from detector import FEED_NS
+from metrics import WEBSUB_HUB_REQUESTS, WEBSUB_NOTIFICATIONS, WEBSUB_SUBSCRIPTIONS
+from scheduler import parse_timestamp
+
+HUB_URL = "https://pubsubhubbub.appspot.com/subscribe"
+TOPIC_URL = "https://www.youtube.com/xml/feeds/videos.xml"
+LEASE_SECONDS = 5 * 24 * 60 * 60  # what the YouTube hub grants anyway
+RENEW_BEFORE = 24 * 60 * 60  # renew a day before the hub would drop us
+RETRY_AFTER = 10 * 60  # wait this long for a verification before asking again
+MAX_AGE = 24 * 60 * 60  # older entries are edits to old videos, not uploads
+
+
+def parse_notification(content):
+    # Returns [(channel_id, video)] with video in UploadDetector's format.
+    # Deletions arrive as at:deleted-entry elements and are skipped.
+    root = ET.fromstring(content)
+    uploads = []
+    for entry in root.findall("atom:entry", FEED_NS):
+        video_id = entry.findtext("yt:videoId", namespaces=FEED_NS)
+        channel_id = entry.findtext("yt:channelId", namespaces=FEED_NS)
+        if not video_id or not channel_id:
+            continue
+        uploads.append((channel_id, (
+            video_id,
+            entry.findtext("atom:title", namespaces=FEED_NS),
+            entry.findtext("atom:author/atom:name", namespaces=FEED_NS),
+            f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",  # not in the push
+            f"https://www.youtube.com/watch?v={video_id}",
+            entry.findtext("atom:published", namespaces=FEED_NS),
+        )))
+    return uploads
+
+
+def sign(secret, body, method="sha1"):
+    return f"{method}={hmac.new(secret.encode('utf-8'), body, method).hexdigest()}"
+
+
+def verify_signature(secret, body, header):
+    # X-Hub-Signature is "<method>=<hex HMAC of the body>"
+    method, _, signature = (header or "").partition("=")
+    if method not in ("sha1", "sha256", "sha384", "sha512"):
+        return False
+    return hmac.compare_digest(sign(secret, body, method), f"{method}={signature}")
+
+
+class PushSubscriber:
+    # Upload notifications pushed by a WebSub (PubSubHubbub) hub. Serves the
+    # callback the hub verifies subscriptions against and POSTs Atom entries
+    # to, keeps one subscription per channel this worker follows, and renews
+    # them before the hub's lease runs out. Polling stays on as a slow fallback
+    # for anything a push misses.
+    def __init__(
+        self, callback_url, on_upload, hub_url=HUB_URL, secret=None, topic_url=TOPIC_URL,
+        lease_seconds=LEASE_SECONDS, renew_before=RENEW_BEFORE, retry_after=RETRY_AFTER,
+        max_age=MAX_AGE, concurrency=10,
+    ):
+        self.callback_url = callback_url
+        self.on_upload = on_upload  # async (channel_id, video)
+        self.hub_url = hub_url
+        # Keep it stable across restarts, or pushes fail to verify until renewal
+        self.secret = secret or secrets.token_hex(16)
+        self.topic_url = topic_url
+        self.lease_seconds = lease_seconds
+        self.renew_before = renew_before
+        self.retry_after = retry_after
+        self.max_age = max_age
+        self.concurrency = concurrency
+        self.wanted = set()
+        self.expires = {}  # channel_id -> when the hub's verified lease ends
+        self.requested = {}  # channel_id -> when we last asked the hub
+        self.seen = OrderedDict()  # recently pushed video IDs
+        self.session = None
+        self.runner = None
+        self.limit = None
+        self.counts = {"notifications": 0, "uploads": 0, "rejected": 0, "renewals": 0}
+
+    def topic(self, channel_id):
+        return f"{self.topic_url}?channel_id={channel_id}"
+
+    @staticmethod
+    def channel_of(topic):
+        return parse_qs(urlparse(topic or "").query).get("channel_id", [None])[0]
+
+    def active(self):
+        # Channels the hub will push for right now
+        now = time.time()
+        return {channel_id for channel_id, expires in self.expires.items() if expires > now}
+
+    async def start(self, host="0.0.0.0", port=8080):
+        path = urlparse(self.callback_url).path or "/"
+        app = web.Application()
+        app.router.add_get(path, self.verify)
+        app.router.add_post(path, self.notify)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        self.session = ClientSession(timeout=ClientTimeout(total=10))
+        self.limit = asyncio.Semaphore(self.concurrency)
+        print(f"Receiving WebSub pushes on http://{host}:{port}{path} as {self.callback_url}")
+        return self.runner
+
+    async def stop(self):
+        if self.session:
+            await self.session.close()
+        if self.runner:
+            await self.runner.cleanup()
+
+    async def verify(self, request):
+        # The hub checks every (un)subscribe with a challenge we must echo
+        mode = request.query.get("hub.mode")
+        channel_id = self.channel_of(request.query.get("hub.topic"))
+        if mode == "subscribe" and channel_id in self.wanted:
+            lease = int(request.query.get("hub.lease_seconds") or self.lease_seconds)
+            self.expires[channel_id] = time.time() + lease
+        elif mode == "unsubscribe" and channel_id not in self.wanted:
+            self.expires.pop(channel_id, None)
+        elif mode == "denied":
+            print(f"Hub denied the subscription for channel {channel_id}: {request.query.get('hub.reason')}")
+            self.expires.pop(channel_id, None)
+            return web.Response(text="")
+        else:
+            return web.Response(status=404)
+        WEBSUB_SUBSCRIPTIONS.set(len(self.expires))
+        return web.Response(text=request.query.get("hub.challenge", ""))
+
+    async def notify(self, request):
+        body = await request.read()
+        self.counts["notifications"] += 1
+        if not verify_signature(self.secret, body, request.headers.get("X-Hub-Signature")):
+            self.counts["rejected"] += 1
+            WEBSUB_NOTIFICATIONS.inc(result="rejected")
+            # Still a 2xx, as the spec asks, so forgers learn nothing
+            return web.Response(status=202)
+        try:
+            uploads = parse_notification(body)
+        except ET.ParseError:
+            WEBSUB_NOTIFICATIONS.inc(result="malformed")
+            return web.Response(status=400)
+        cutoff = time.time() - self.max_age
+        for channel_id, video in uploads:
+            published = parse_timestamp(video[5])
+            if (
+                channel_id not in self.wanted or video[0] in self.seen
+                or (published is not None and published < cutoff)
+            ):
+                WEBSUB_NOTIFICATIONS.inc(result="ignored")
+                continue
+            self.seen[video[0]] = None
+            while len(self.seen) > 1000:
+                self.seen.popitem(last=False)
+            self.counts["uploads"] += 1
+            WEBSUB_NOTIFICATIONS.inc(result="upload")
+            await self.on_upload(channel_id, video)
+        return web.Response(status=204)
+
+    async def sync(self, channel_ids):
+        # Subscribes new channels, renews leases close to running out and
+        # unsubscribes channels this worker no longer follows
+        channel_ids = set(channel_ids)
+        removed = self.wanted - channel_ids
+        self.wanted = channel_ids
+        now = time.time()
+        due = [
+            channel_id for channel_id in channel_ids
+            if self.expires.get(channel_id, 0) - self.renew_before < now
+            and self.requested.get(channel_id, 0) + self.retry_after < now
+        ]
+        for channel_id in due:
+            if channel_id in self.expires:
+                self.counts["renewals"] += 1
+            self.requested[channel_id] = now
+        for channel_id in removed:
+            self.requested.pop(channel_id, None)
+        await asyncio.gather(
+            *(self.request(channel_id, "subscribe") for channel_id in due),
+            *(self.request(channel_id, "unsubscribe") for channel_id in removed),
+        )
+
+    async def request(self, channel_id, mode):
+        # The hub answers 202 and verifies through our callback later
+        data = {
+            "hub.callback": self.callback_url,
+            "hub.mode": mode,
+            "hub.topic": self.topic(channel_id),
+            "hub.verify": "async",
+            "hub.lease_seconds": str(self.lease_seconds),
+            "hub.secret": self.secret,
+        }
+        async with self.limit:
+            try:
+                async with self.session.post(self.hub_url, data=data) as response:
+                    ok = response.status < 300
+                    if not ok:
+                        print(f"Hub refused to {mode} channel {channel_id}: {response.status}")
+            except (ClientError, asyncio.TimeoutError) as e:
+                print(f"Could not {mode} channel {channel_id} at the hub: {e}")
+                ok = False
+        WEBSUB_HUB_REQUESTS.inc(mode=mode, result="accepted" if ok else "failed")
+        return ok
+
+    def stats(self):
+        return dict(self.counts, subscribed=len(self.active()), wanted=len(self.wanted))
@@ -0,0 +1,37 @@
+import os
+import threading
+
+# Pinned copy of the YouTube Data API v3 discovery document, so startup never
+# depends on fetching one or on whichever copy the installed library bundles
+DISCOVERY_DOCUMENT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "discovery", "youtube.v3.json"
+)
+
+
+class YouTubeClient:
+    # Drop-in for the googleapiclient resource that builds it on first use.
+    # googleapiclient itself is only imported then, keeping it off the launch path.
+    def __init__(self, api_key, api_endpoint=None, document=DISCOVERY_DOCUMENT):
+        self.api_key = api_key
+        self.api_endpoint = api_endpoint
+        self.document = document
+        self.lock = threading.Lock()
+        self._resource = None
+
+    def resource(self):
+        if self._resource is None:
+            with self.lock:
+                if self._resource is None:
+                    from googleapiclient.discovery import build_from_document
+
+                    with open(self.document, encoding="utf-8") as f:
+                        document = f.read()
+                    client_options = {"api_endpoint": self.api_endpoint} if self.api_endpoint else None
+                    self._resource = build_from_document(
+                        document, developerKey=self.api_key, client_options=client_options
+                    )
+        return self._resource
+
+    def __getattr__(self, name):
+        # channels(), videos(), search()... all come from the built resource
+        return getattr(self.resource(), name)